@@ -0,0 +1,261 @@
+"""
+batch.py
+Builds code plugs for many operators at once, e.g., for a club whose members
+share the repeater and talkgroup data but each have their own radio IDs,
+channel requests and regions.
+
+Each member has a directory of overlay files in the members directory:
+
+    members/
+        al/
+            radio_ids.yaml
+            channel_requests.yaml
+        kathe/
+            radio_ids.yaml
+            lat_long.yaml
+
+Any of the data_files YAML files may be overlaid.  A member's file replaces
+the shared one, except that a member's repeaters_*.yaml files add to (or
+change) the shared repeaters.  If a member has any channel_requests*.yaml
+files, they replace all the shared ones.
+
+The shared data_files and the RepeaterBook exports are read once.  The
+members are then built in worker processes.  Where processes are forked
+(Linux), the workers share the parsed data with this one, copy-on-write;
+elsewhere it is sent to each worker once.  Each member's CSV files and zone
+table, and a build.log of the messages from the build, are written to
+<output>/<member>/878 and/or 578, and a summary of the timings and failures
+to <output>/batch_summary.txt.
+"""
+import argparse
+from contextlib import redirect_stdout
+import copy
+from glob import glob
+import os
+import time
+import traceback
+
+import builder
+# The YAML parser, RepeaterBook reading and process pools are imported in
+# the functions that use them, so --help starts quickly; see cli.py.
+
+SUMMARY_FILE = 'batch_summary.txt'
+
+# The data files a member may overlay, and the CodePlugConfig attribute
+# each one replaces.  repeaters*.yaml and channel_requests*.yaml are handled
+# separately, as there may be several of them.
+OVERLAY_FILES = {
+    'radio_ids.yaml': 'radio_ids',
+    'talkgroups.yaml': 'talkgroups',
+    'simplex.yaml': 'simplex',
+    'special_zones.yaml': 'special_zones',
+    'channel_defaults.yaml': 'channel_defaults',
+    'field_names.yaml': 'field_names',
+    'lat_long.yaml': 'lat_long',
+    'zone_order.yaml': 'zone_order',
+}
+
+# The shared data, set in each worker by init_worker().
+shared = None
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Build code plugs for many members at once.")
+    parser.add_argument('members',
+                        help="A directory with a subdirectory of overlay "
+                             "data files for each member")
+    parser.add_argument('--AT878', action='store_true',
+                        help="Build each member's AT878 code plug")
+    parser.add_argument('--AT578', action='store_true',
+                        help="Build each member's AT578 code plug")
+    parser.add_argument('--output', metavar='DIR',
+                        help="Where to write the members' code plugs. "
+                             "Default: the members directory")
+    parser.add_argument('--repeaterbook', action='append', metavar='PATH',
+                        help="RepeaterBook export(s) to load, as for "
+                             "builder.py")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="How many members to build, and RepeaterBook "
+                             "CSV sheets to read, at once. Default: the "
+                             "number of CPUs")
+    options = parser.parse_args(argv)
+    if not (options.AT578 or options.AT878):
+        parser.error("At least one of AT578 or AT878 must be supplied.")
+    return options
+
+
+def load_shared_data(repeaterbook=None, jobs=1):
+    """
+    Reads the shared data files and RepeaterBook exports.
+    :param repeaterbook: A list of RepeaterBook export paths, or None.
+    :param jobs: How many RepeaterBook CSV sheets to read at once.
+    :return: A dict of:
+        config: A CodePlugConfig from the shared data files
+        located: Every RepeaterBook repeater meeting the criteria, from
+            located_repeaters(), for members with their own lat_long.yaml.
+    """
+    from parse_cache import ParseCache
+    from repeaters_from_repeaterbook import located_repeaters, \
+        select_located_repeaters
+    cache = ParseCache()
+    data = builder.load_data_from_yaml_files(cache)
+    located = located_repeaters(repeaterbook, jobs)
+    repeaters = data[1]
+    lat_long = data[8]
+    config = builder.CodePlugConfig(
+        *data, analog_repeaters=select_located_repeaters(located, lat_long),
+        locations=builder.load_repeater_locations(cache, repeaters))
+    return {'config': config, 'located': located}
+
+
+def init_worker(shared_data):
+    global shared
+    shared = shared_data
+
+
+def member_config(member_dir):
+    """
+    Makes a member's config: the shared one, with the member's files laid
+    over it.  The shared data isn't changed.
+    :param member_dir: The member's directory of overlay files.
+    :return: A CodePlugConfig
+    """
+    from create_zone_table import comment_locations, repeater_locations
+    from parse_cache import parse_yaml
+    from repeaters_from_repeaterbook import select_located_repeaters
+    # A copy starts with nothing made from the data (see
+    # CodePlugConfig.__copy__), so what this member's build makes can't
+    # leak into the next member built in this worker.
+    config = copy.copy(shared['config'])
+    for file_name, attribute in OVERLAY_FILES.items():
+        path = os.path.join(member_dir, file_name)
+        if os.path.exists(path):
+            setattr(config, attribute, parse_yaml(path))
+    if os.path.exists(os.path.join(member_dir, 'simplex.yaml')):
+        config.simplex = {str(key): value
+                          for key, value in config.simplex.items()}
+
+    repeater_files = sorted(glob(os.path.join(member_dir, 'repeaters*')))
+    if repeater_files:
+        config.repeaters = dict(config.repeaters)
+        config.locations = dict(config.locations)
+        for path in repeater_files:
+            repeaters = parse_yaml(path)
+            config.repeaters.update(repeaters)
+            config.locations.update(
+                repeater_locations(repeaters, comment_locations(path)))
+    request_files = sorted(glob(os.path.join(member_dir,
+                                             'channel_requests*')))
+    if request_files:
+        config.channel_requests = []
+        for path in request_files:
+            config.channel_requests += parse_yaml(path)
+
+    if config.lat_long is not shared['config'].lat_long:
+        config.analog_repeaters = select_located_repeaters(shared['located'],
+                                                           config.lat_long)
+    return config
+
+
+def build_member(member_dir, output_dir, target_names):
+    """
+    Builds and writes one member's code plugs.  Runs in a worker process.
+    :param member_dir: The member's directory of overlay files.
+    :param output_dir: The directory to write the member's code plugs in.
+    :param target_names: The names of the Targets to build for.
+    :return: A dict summarizing the build: member, seconds, channels and
+        zones (per target), and error (None if it worked).
+    """
+    name = os.path.basename(member_dir)
+    result = {'member': name, 'seconds': 0, 'channels': {}, 'zones': {},
+              'error': None}
+    start = time.perf_counter()
+    try:
+        config = member_config(member_dir)
+        for target in builder.TARGETS:
+            if target.name not in target_names:
+                continue
+            directory = os.path.join(output_dir, name,
+                                     os.path.basename(target.directory))
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, 'build.log'), 'w') as log, \
+                    redirect_stdout(log):
+                codeplug = builder.build_codeplug(config.with_target(target))
+                codeplug.write(directory)
+                codeplug.write_zone_table(directory)
+                if codeplug.duplicate_finder is not None:
+                    codeplug.duplicate_finder.report(target.name)
+            result['channels'][target.name] = len(codeplug.channels)
+            result['zones'][target.name] = len(codeplug.zones)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def write_summary(results, total_seconds, path):
+    """
+    Prints the summary of the members' builds, and writes it to a file.
+    :param results: The dicts from build_member().
+    :param total_seconds: The wall time for the whole batch.
+    :param path: The file to write.
+    :return: None
+    """
+    failures = [result for result in results if result['error']]
+    lines = [f"{'Member':30} {'Status':7} {'Seconds':>8}  Channels / zones"]
+    for result in results:
+        status = 'FAILED' if result['error'] else 'ok'
+        counts = ', '.join(f"{target}: {result['channels'][target]} / "
+                           f"{result['zones'][target]}"
+                           for target in result['channels'])
+        lines.append(f"{result['member']:30} {status:7} "
+                     f"{result['seconds']:8.2f}  {counts}")
+    lines.append(f"{len(results)} members, {len(failures)} failed, "
+                 f"{total_seconds:.2f} seconds")
+    for result in failures:
+        lines.append('')
+        lines.append(f"{result['member']}:")
+        lines.append(result['error'].rstrip())
+    text = '\n'.join(lines)
+    print(text)
+    with open(path, 'w') as f:
+        print(text, file=f)
+
+
+def main(argv=None, prog=None):
+    options = parse_args(argv, prog)
+    start = time.perf_counter()
+    output_dir = options.output or options.members
+    member_dirs = sorted(path for path in glob(os.path.join(options.members,
+                                                            '*'))
+                         if os.path.isdir(path) and
+                         os.path.abspath(path) != os.path.abspath(output_dir))
+    target_names = [target.name for target in builder.TARGETS
+                    if getattr(options, target.name)]
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    shared_data = load_shared_data(options.repeaterbook,
+                                   max(1, options.jobs))
+    # Forked workers get the shared data without it being pickled.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(max(1, options.jobs), mp_context=context,
+                             initializer=init_worker,
+                             initargs=(shared_data,)) as executor:
+        futures = [executor.submit(build_member, member_dir, output_dir,
+                                   target_names)
+                   for member_dir in member_dirs]
+        results = [future.result() for future in futures]
+
+    write_summary(results, time.perf_counter() - start,
+                  os.path.join(output_dir, SUMMARY_FILE))
+    if any(result['error'] for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""
+benchmark.py
+Measures how the code plug build scales.  A synthetic data_files tree is
+generated in a temporary directory, with as many repeaters, talkgroups,
+radio IDs, GROUP_ entries, special zones and RepeaterBook rows as asked
+for, and each stage of the build is timed against it.  The peak memory
+allocated by each stage is recorded too.  The stages are the functions
+decorated with @timed; see timing.py.
+
+The results are printed, and can be appended as a line of JSON to a file,
+so that they can be compared from one version of the code to the next.
+
+With --startup, the time each cli.py command takes to start is measured
+instead, and checked against cli.STARTUP_TARGET_SECONDS.
+
+With --csv, the code plug is built in memory, and the time to turn each of
+its tables into CSV text is measured for each of CSV_WRITERS: csv.DictWriter,
+csv.writer over builder.csv_rows(), and the builder.CsvLayout the build
+uses.  They must all give the same text.  --repeaters 400 fills an AT578
+(4000 channels).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import builder
+import cli
+from duplicates import DUPLICATE_MODES
+from timing import timer
+
+# The RepeaterBook CSV columns the program uses.
+RB_FIELD_NAMES = ['Output Freq', 'Input Freq', 'Uplink Tone', 'Downlink Tone',
+                  'Location', 'Lat', 'Long', 'Use', 'Op Status', 'Mode']
+
+# The synthetic RepeaterBook repeaters are scattered over this box, and
+# lat_long.yaml selects the middle of it.
+RB_BOX = {'N': 45.0, 'S': 40.0, 'W': -115.0, 'E': -105.0}
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Time the build against synthetic data.")
+    parser.add_argument('--repeaters', type=int, default=100,
+                        help="Repeaters in repeaters_*.yaml, half digital "
+                             "and half analog, all requested")
+    parser.add_argument('--talkgroups', type=int, default=10,
+                        help="Talkgroups listed in each digital repeater's "
+                             "channel request")
+    parser.add_argument('--radio-ids', type=int, default=2,
+                        help="Radio IDs in radio_ids.yaml")
+    parser.add_argument('--groups', type=int, default=2,
+                        help="GROUP_ entries used by each digital repeater's "
+                             "channel request")
+    parser.add_argument('--group-size', type=int, default=5,
+                        help="Talkgroups in each GROUP_ entry")
+    parser.add_argument('--special-zones', type=int, default=10,
+                        help="Zones in special_zones.yaml, besides ALL_ZONES")
+    parser.add_argument('--rb-rows', type=int, default=2000,
+                        help="Rows in the RepeaterBook export")
+    parser.add_argument('--target', choices=[t.name for t in builder.TARGETS],
+                        default='AT578', help="The radio to build for")
+    parser.add_argument('--duplicates', choices=DUPLICATE_MODES,
+                        help="Look for duplicate channels, as builder.py "
+                             "--duplicates does")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Don't measure memory. Tracing allocations "
+                             "slows the stages down.")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Append the results, as a line of JSON, to FILE")
+    parser.add_argument('--seed', type=int, default=1,
+                        help="Random number seed for the synthetic data")
+    parser.add_argument('--startup', action='store_true',
+                        help="Measure how long each cli.py command takes to "
+                             "start, rather than the build. Fails if any "
+                             "takes longer than the target")
+    parser.add_argument('--csv', action='store_true',
+                        help="Time the ways of writing the CSV files, rather "
+                             "than the build")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="With --startup or --csv, time each command or "
+                             "writer this many times, and take the fastest")
+    return parser.parse_args(argv)
+
+
+def make_data_files(root, options):
+    """
+    Writes a synthetic data_files tree.  channel_defaults.yaml and
+    field_names.yaml are copied from the real data_files.
+    :param root: The directory in which to make data_files.
+    :param options: The parsed command line.
+    :return: None
+    """
+    # Imported here, as only the build benchmark needs it.
+    import yaml
+    random.seed(options.seed)
+    data_dir = os.path.join(root, 'data_files')
+    os.makedirs(os.path.join(data_dir, 'rb_repeaters'))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ['channel_defaults.yaml', 'field_names.yaml']:
+        shutil.copy(os.path.join(here, 'data_files', name), data_dir)
+
+    def dump(name, data):
+        with open(os.path.join(data_dir, name), 'w') as f:
+            yaml.safe_dump(data, f, sort_keys=False)
+
+    dump('radio_ids.yaml', [{'Name': f'ID{i}', 'Radio ID': 3100000 + i,
+                             'Abbrev': f'I{i}'}
+                            for i in range(options.radio_ids)])
+
+    group_talkgroups = options.groups * options.group_size
+    talkgroup_count = max(options.talkgroups, group_talkgroups)
+    talkgroups = {f'TG{i}': 31000 + i for i in range(talkgroup_count)}
+    talkgroups['TgDisc'] = 4000
+    dump('talkgroups.yaml', talkgroups)
+
+    repeaters = {}
+    requests = []
+    for g in range(options.groups):
+        members = range(g * options.group_size, (g + 1) * options.group_size)
+        requests.append({f'GROUP_{g}': [f'TG{i}' for i in members]})
+    for i in range(options.repeaters):
+        rx = round(440.0 + (i % 400) * 0.025, 4)
+        if i % 2:
+            name = f'A{i}'
+            repeaters[name] = {'Name': name, 'RX': rx, 'TX': rx + 5,
+                               'Mode': 'A', 'CTCSS': 100.0}
+            requests.append({'R': name})
+        else:
+            name = f'D{i}'
+            repeaters[name] = {'Name': name, 'RX': rx, 'TX': rx + 5,
+                               'Mode': 'D', 'CC': 1, 'DynamicTGs': 1,
+                               'StaticTGs': {1: [31000], 2: [31001]}}
+            tgs = [f'TG{t}' for t in range(options.talkgroups)]
+            tgs += [f'GROUP_{g}' for g in range(options.groups)]
+            requests.append({'R': name, 'T': tgs})
+    dump('repeaters_synthetic.yaml', repeaters)
+
+    simplex = {'146.52': {'Freq': 146.52, 'Mode': 'A'},
+               '446.0': {'Freq': 446.0, 'Mode': 'A'},
+               'Simp D': {'Freq': 441.0, 'Mode': 'D'}}
+    dump('simplex.yaml', simplex)
+    requests += [{'S': name} for name in simplex]
+    dump('channel_requests.yaml', requests)
+
+    analog_names = [name for name in repeaters if name.startswith('A')]
+    special_zones = {'ALL_ZONES': ['146.52', '446.0']}
+    for z in range(options.special_zones):
+        special_zones[f'Special {z}'] = random.sample(
+            analog_names, min(10, len(analog_names)))
+    dump('special_zones.yaml', special_zones)
+
+    lat_long = [{'N': 44.0, 'S': 41.0, 'W': -113.0, 'E': -107.0}]
+    dump('lat_long.yaml', lat_long)
+    dump('zone_order.yaml', ['simplex'])
+
+    with open(os.path.join(data_dir, 'rb_repeaters', 'Synthetic_2m.csv'), 'w',
+              newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RB_FIELD_NAMES)
+        for i in range(options.rb_rows):
+            rx = 145.1 + (i % 120) * 0.015
+            writer.writerow([f'{rx:.5f}', f'{rx - 0.6:.5f}', '100.0', '',
+                             f'Town {i}',
+                             f"{random.uniform(RB_BOX['S'], RB_BOX['N']):.6f}",
+                             f"{random.uniform(RB_BOX['W'], RB_BOX['E']):.6f}",
+                             'OPEN', 'On-Air', 'Analog'])
+
+
+def run_build(target, duplicates=None):
+    """
+    Runs the build in the current directory.  The stages time themselves;
+    see timing.py.
+    :param target: The Target to build for.
+    :param duplicates: None, or the builder.py --duplicates mode.
+    :return: The number of channels and zones made.
+    """
+    config = builder.CodePlugConfig.from_data_files(target=target,
+                                                    duplicates=duplicates)
+    codeplug = builder.build_codeplug(config)
+    codeplug.write()
+    return len(codeplug.channels), len(codeplug.zones)
+
+
+def dictwriter_csv(dicts_to_write, field_names, f):
+    """
+    Writes a table with csv.DictWriter, for comparison.
+    :param dicts_to_write: The table, a list of dicts.
+    :param field_names: The CSV column names, in order.
+    :param f: The file, opened with newline=''.
+    :return: None
+    """
+    writer = csv.DictWriter(f, field_names, extrasaction='ignore',
+                            quoting=csv.QUOTE_ALL)
+    writer.writeheader()
+    for i, this_dict in enumerate(dicts_to_write):
+        row = {key: builder.fix_list_member(value)
+               for key, value in this_dict.items()}
+        if 'No.' in field_names:
+            row['No.'] = str(i + 1)
+        writer.writerow(row)
+
+
+def csv_writer_csv(dicts_to_write, field_names, f):
+    """
+    Writes a table with csv.writer, each row a list of values looked up by
+    column name (builder.csv_rows()), for comparison.
+    :param dicts_to_write: The table, a list of dicts.
+    :param field_names: The CSV column names, in order.
+    :param f: The file, opened with newline=''.
+    :return: None
+    """
+    writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+    writer.writerow(field_names)
+    writer.writerows(builder.csv_rows(dicts_to_write, field_names))
+
+
+# The ways of writing a table compared by --csv; the last is the one the
+# build uses.
+CSV_WRITERS = {
+    'DictWriter': dictwriter_csv,
+    'csv.writer': csv_writer_csv,
+    'CsvLayout': builder.write_csv,
+}
+
+
+def measure_csv(codeplug, runs):
+    """
+    Times writing each of a code plug's tables, to memory, with each of
+    CSV_WRITERS.  Exits if they don't all give the same text.
+    :param codeplug: A built CodePlug.
+    :param runs: How many times to write each table with each writer; the
+        fastest is taken.
+    :return: A dict of dicts of the seconds taken, keyed by table, then by
+        writer.
+    """
+    results = {}
+    for name in builder.TABLES:
+        table = codeplug.table(name)
+        field_names = codeplug.field_names[name]
+        results[name] = {}
+        texts = set()
+        for writer_name, write in CSV_WRITERS.items():
+            seconds = []
+            for _ in range(runs):
+                f = io.StringIO(newline='')
+                start = time.perf_counter()
+                write(table, field_names, f)
+                seconds.append(time.perf_counter() - start)
+            results[name][writer_name] = min(seconds)
+            texts.add(f.getvalue())
+        if len(texts) != 1:
+            sys.exit(f"The CSV writers wrote different {name}.csv files.")
+    return results
+
+
+def report_csv(options):
+    """
+    Builds a code plug from synthetic data, then measures and prints how
+    long each way of writing its tables takes, and appends the results to
+    the --output file.
+    :param options: The parsed command line.
+    :return: None
+    """
+    target = next(t for t in builder.TARGETS if t.name == options.target)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        make_data_files(root, options)
+        os.chdir(root)
+        try:
+            config = builder.CodePlugConfig.from_data_files(
+                target=target, duplicates=options.duplicates)
+            codeplug = builder.build_codeplug(config)
+            sizes = {name: len(codeplug.table(name))
+                     for name in builder.TABLES}
+        finally:
+            os.chdir(cwd)
+
+    results = measure_csv(codeplug, options.runs)
+    print(f"{'Table':12} {'Rows':>6}" +
+          ''.join(f" {writer_name:>12}" for writer_name in CSV_WRITERS) +
+          f" {'Speed-up':>9}")
+    for name, seconds in results.items():
+        speed_up = seconds['DictWriter'] / seconds['CsvLayout']
+        print(f"{name:12} {sizes[name]:6}" +
+              ''.join(f" {seconds[writer_name]:12.4f}"
+                      for writer_name in CSV_WRITERS) +
+              f" {speed_up:8.1f}x")
+
+    if options.output:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'parameters': {key: value for key, value in vars(options).items()
+                           if key not in ('output', 'startup')},
+            'rows': sizes,
+            'csv_seconds': results,
+        }
+        with open(options.output, 'a') as f:
+            print(json.dumps(record), file=f)
+
+
+def measure_startup(runs):
+    """
+    Times starting each cli.py command, with --help, in a new interpreter.
+    The time the interpreter itself takes to start is taken off.
+    :param runs: How many times to start each; the fastest is taken.
+    :return: A dict of the seconds taken, keyed by command ('' for cli.py
+        on its own).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def fastest(arguments):
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + arguments, cwd=here,
+                           stdout=subprocess.DEVNULL, check=True)
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    interpreter = fastest(['-c', 'pass'])
+    results = {'': fastest(['cli.py', '--help']) - interpreter}
+    for command in cli.COMMANDS:
+        results[command] = fastest(['cli.py', command, '--help']) - \
+            interpreter
+    return results
+
+
+def report_startup(options):
+    """
+    Measures and prints the startup times, and appends them to the --output
+    file.  Exits with status 1 if any is over the target.
+    :param options: The parsed command line.
+    :return: None
+    """
+    results = measure_startup(options.runs)
+    target = cli.STARTUP_TARGET_SECONDS
+    print(f"{'Command':30} {'Seconds':>9}  (target {target:.3f})")
+    for command, seconds in results.items():
+        flag = '' if seconds <= target else '  OVER TARGET'
+        print(f"{'cli.py ' + command:30} {seconds:9.4f}{flag}")
+
+    if options.output:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'startup_seconds': results,
+            'startup_target_seconds': target,
+        }
+        with open(options.output, 'a') as f:
+            print(json.dumps(record), file=f)
+    if any(seconds > target for seconds in results.values()):
+        sys.exit(1)
+
+
+def git_revision():
+    """
+    :return: The current git commit of this code, or None if unknown.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None, prog=None):
+    options = parse_args(argv, prog)
+    if options.startup:
+        report_startup(options)
+        return
+    if options.csv:
+        report_csv(options)
+        return
+    target = next(t for t in builder.TARGETS if t.name == options.target)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        make_data_files(root, options)
+        out_dir = os.path.join(root, 'out')
+        os.mkdir(out_dir)
+        target = builder.Target(target.name, out_dir, target.has_220,
+                                target.max_channels, target.max_zones,
+                                target.max_zone_channels)
+        os.chdir(root)
+        timer.start(measure_memory=not options.no_memory)
+        start = time.perf_counter()
+        try:
+            channel_count, zone_count = run_build(target,
+                                                  options.duplicates)
+        finally:
+            total = time.perf_counter() - start
+            timer.stop()
+            os.chdir(cwd)
+
+    print(f"{channel_count} channels, {zone_count} zones")
+    timer.report()
+    print(f"{'Total':50} {'':6} {total:9.4f}")
+
+    if options.output:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'parameters': {key: value for key, value in vars(options).items()
+                           if key not in ('output', 'startup', 'csv',
+                                          'runs')},
+            'channels': channel_count,
+            'zones': zone_count,
+            'seconds': total,
+            'stages': timer.results,
+        }
+        with open(options.output, 'a') as f:
+            print(json.dumps(record), file=f)
+
+
+if __name__ == '__main__':
+    main()
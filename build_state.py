@@ -0,0 +1,93 @@
+"""
+build_state.py
+Support for incremental builds.  The content hashes of the input files, and
+of the data each stage of the build was made from, are recorded in a state
+file in the output directory.  On the next build, a stage whose data hasn't
+changed (and whose output files are still there) is skipped.
+"""
+import hashlib
+import json
+import os
+
+STATE_FILE = '.build_state.json'
+
+
+def file_digest(paths):
+    """
+    Hash the contents of a list of files.
+    :param paths: The files to hash.  Their names are part of the hash, so
+        renaming a file counts as a change.
+    :return: A hex digest.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(path.encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def data_digest(*data):
+    """
+    Hash some parsed data, e.g., the dicts read from the YAML files.
+    :param data: Anything that can be converted to JSON.  Keys are sorted,
+        and anything JSON doesn't know about is converted with str().
+    :return: A hex digest.
+    """
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class BuildState:
+    """
+    The digests recorded by the last build into an output directory.  When
+    the build isn't incremental, every stage is rebuilt and nothing is
+    recorded.
+    """
+    def __init__(self, directory, incremental=True):
+        self.directory = directory
+        self.incremental = incremental
+        self.path = os.path.join(directory, STATE_FILE)
+        self.digests = {}
+        self.rebuilt = []
+        if incremental:
+            try:
+                with open(self.path) as f:
+                    self.digests = json.load(f)
+            except (OSError, ValueError):
+                # No state yet, or it's damaged.  Rebuild everything.
+                self.digests = {}
+
+    def is_current(self, stage, digest, outputs=()):
+        """
+        :param stage: The name of a stage of the build.
+        :param digest: The digest of the data the stage would be built from.
+        :param outputs: The files the stage writes, relative to the output
+            directory.
+        :return: True if the stage was last built from the same data and its
+            outputs are all still there.
+        """
+        if not self.incremental:
+            return False
+        if self.digests.get(stage) != digest:
+            return False
+        return all(os.path.exists(os.path.join(self.directory, output))
+                   for output in outputs)
+
+    def built(self, stage, digest, outputs=()):
+        """
+        Record that a stage has been built.
+        :param stage: The name of the stage.
+        :param digest: The digest of the data it was built from.
+        :param outputs: The files it wrote.
+        :return: None
+        """
+        self.digests[stage] = digest
+        self.rebuilt += outputs
+
+    def save(self):
+        if not self.incremental:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.digests, f, indent=1, sort_keys=True)
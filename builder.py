@@ -1,28 +1,342 @@
 import argparse
-import csv
+import copy
+import io
 import os
-import yaml
+import time
+from collections.abc import MutableMapping
 from glob import glob
-from repeaters_from_repeaterbook import get_analog_repeaters_from_repeaterbook
+from itertools import islice, repeat
+from build_state import BuildState, data_digest, file_digest
+from capacity import fit_channels, fit_zones, prune_repeaterbook_repeaters, \
+    split_state_zones
+from create_zone_table import LOCATIONS_FILE, ZONE_TABLE_FILE, \
+    LocationIndex, comment_locations, repeater_locations, write_zone_table, \
+    zone_table_lines
+from duplicates import DUPLICATE_MODES, DuplicateFinder
+from ordering import ORDERS, make_order
+import timing
+from timing import timed
+# The YAML parser (parse_cache), RepeaterBook reading, process pools and
+# file watching are imported in the functions that use them, so that
+# commands that don't need them, e.g., --help, start quickly; see cli.py.
 
 args = 0
 
+# Where the YAML data files are.
+DATA_DIR = 'data_files'
 
-def parse_args():
-    global args
-    parser = argparse.ArgumentParser()
+# The tables in a code plug, each written to <table>.csv.
+TABLES = ['talkgroups', 'channels', 'radio_ids', 'zones']
+
+# The files written for each radio, including the zone cheat sheet; see
+# create_zone_table.py.
+ALL_OUTPUTS = [table + '.csv' for table in TABLES] + [ZONE_TABLE_FILE,
+                                                      LOCATIONS_FILE]
+
+# The talkgroups.csv columns.
+TALKGROUP_FIELD_NAMES = ['No.', "Radio ID", "Name", "Call Type", "Call Alert"]
+
+# How many CSV lines to join up before each write to the file.
+CSV_BATCH_SIZE = 512
+
+# Bump this when a change to the code changes what is written from the same
+# data and options, so that the outputs of an incremental build made by the
+# old code are rebuilt.  It is part of every digest recorded.
+OUTPUT_FORMAT = 2
+
+
+class Target:
+    """
+    A radio model to build a code plug for.  The differences between the
+    models we support are whether they have the 220 band, and where their
+    CSV files are written.  The capacity limits are there so a model with
+    less memory can be added; see capacity.py.
+    """
+    def __init__(self, name, directory, has_220, max_channels=4000,
+                 max_zones=250, max_zone_channels=250):
+        self.name = name
+        self.directory = directory
+        self.has_220 = has_220
+        self.max_channels = max_channels
+        self.max_zones = max_zones
+        self.max_zone_channels = max_zone_channels
+
+    def skips(self, repeater):
+        """
+        :param repeater: A repeater dict.
+        :return: True if the repeater is on a band this radio doesn't have.
+        """
+        return not self.has_220 and 200.0 < float(repeater['RX']) < 400.0
+
+
+TARGETS = [Target('AT878', '../878', has_220=False),
+           Target('AT578', '../578', has_220=True)]
+
+
+class Channel(MutableMapping):
+    """
+    A channel.  A code plug has thousands of channels, each with about fifty
+    CSV columns, but only a handful of those differ from channel_defaults.
+    Rather than each channel having a copy of the defaults, a Channel holds
+    only the fields that have been set, and looks up anything else in the
+    (shared) defaults dict.
+
+    Otherwise it behaves like the dict it replaces.  Deleting a field that
+    has been set puts it back to its default.
+    """
+    __slots__ = ('_defaults', '_fields')
+
+    def __init__(self, defaults):
+        self._defaults = defaults
+        self._fields = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._fields[key]
+        except KeyError:
+            return self._defaults[key]
+
+    def __setitem__(self, key, value):
+        self._fields[key] = value
+
+    def __delitem__(self, key):
+        del self._fields[key]
+
+    def __contains__(self, key):
+        return key in self._fields or key in self._defaults
+
+    def __iter__(self):
+        yield from self._defaults
+        for key in self._fields:
+            if key not in self._defaults:
+                yield key
+
+    def __len__(self):
+        return len(self._defaults) + sum(1 for key in self._fields
+                                         if key not in self._defaults)
+
+    def __repr__(self):
+        return f"Channel({self._fields!r})"
+
+    def layers(self):
+        """
+        :return: The defaults dict, and a dict of the fields that have been
+            set.  Anything not set is the default.  For writing the channels
+            quickly; see CsvLayout.
+        """
+        return self._defaults, self._fields
+
+
+class Zone:
+    """
+    A zone and its member channels.  The CPS wants the members (and their
+    frequencies) in the order they were added, so they are kept in lists.
+    A set of the member names sits alongside the lists so that checking
+    whether a channel is already in the zone doesn't have to scan the list;
+    that check happens for every special zone channel in every zone.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.members = []
+        self.rx_frequencies = []
+        self.tx_frequencies = []
+        self._member_names = set()
+
+    def __contains__(self, channel_name):
+        return channel_name in self._member_names
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, channel):
+        """
+        Add a channel to the end of the zone, unless it is already a member.
+        :param channel: A channel dict
+        :return: True if the channel was added, False if it was already there.
+        """
+        channel_name = channel['Channel Name']
+        if channel_name in self._member_names:
+            return False
+        self._member_names.add(channel_name)
+        self.members.append(channel_name)
+        self.rx_frequencies.append(channel['Receive Frequency'])
+        self.tx_frequencies.append(channel['Transmit Frequency'])
+        return True
+
+    def extend(self, other):
+        """
+        Add the members of another zone to the end of this one, skipping any
+        already in this zone.
+        :param other: A Zone
+        :return: None
+        """
+        for name, rx, tx in zip(other.members, other.rx_frequencies,
+                                other.tx_frequencies):
+            self.add({'Channel Name': name,
+                      'Receive Frequency': rx,
+                      'Transmit Frequency': tx})
+
+    def discard(self, channel_names):
+        """
+        Take channels out of the zone.  Those not in it are ignored.
+        :param channel_names: A set of channel names.
+        :return: None
+        """
+        kept = [member for member in zip(self.members, self.rx_frequencies,
+                                         self.tx_frequencies)
+                if member[0] not in channel_names]
+        self.members = [name for name, _, _ in kept]
+        self.rx_frequencies = [rx for _, rx, _ in kept]
+        self.tx_frequencies = [tx for _, _, tx in kept]
+        self._member_names = set(self.members)
+
+    def subset(self, name, channel_names):
+        """
+        Make a new zone from some of this zone's channels.
+        :param name: The new zone's name.
+        :param channel_names: A set of the names of the channels to include.
+        :return: A Zone with those channels, in the order they are in this
+            one.
+        """
+        zone = Zone(name)
+        for member in zip(self.members, self.rx_frequencies,
+                          self.tx_frequencies):
+            if member[0] in channel_names:
+                zone.add({'Channel Name': member[0],
+                          'Receive Frequency': member[1],
+                          'Transmit Frequency': member[2]})
+        return zone
+
+    def to_dict(self):
+        """
+        The zone in the form written to zones.csv.  The A and B channels are
+        the first two members of the zone.  The member lists are the zone's
+        own, not copies.
+        :return: A zone dict
+        """
+        zone = {
+            'Zone Name': self.name,
+            'Zone Channel Member': self.members,
+            'Zone Channel Member RX Frequency': self.rx_frequencies,
+            'Zone Channel Member TX Frequency': self.tx_frequencies
+        }
+        for i, prefix in enumerate(['A Channel', 'B Channel']):
+            if len(self.members) > i:
+                zone[prefix] = self.members[i]
+                zone[prefix + ' RX Frequency'] = self.rx_frequencies[i]
+                zone[prefix + ' TX Frequency'] = self.tx_frequencies[i]
+        return zone
+
+
+def make_parser(prog=None):
+    """
+    :param prog: The program name for the usage message, e.g., when run as
+        a cli.py subcommand.  Default: this script's.
+    :return: The argparse parser for the command line.
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Build the code plug CSV files for AnyTone CPS.")
     parser.add_argument('--AT878', action='store_true',
                         help="Omit any 220 frequencies, save files in ../878")
     parser.add_argument('--AT578', action='store_true',
                         help="Include any 220 frequencies, save files in ../578")
-    args = parser.parse_args()
-    if args.AT578 and args.AT878:
-        parser.error("AT578 and AT878 are mutually exclusive")
+    parser.add_argument('--repeaterbook', action='append', metavar='PATH',
+                        help="RepeaterBook CSV export(s) to load: a directory "
+                             "of CSV files, a CSV or gzipped CSV file, a zip "
+                             "archive of CSV files, or a store made by "
+                             "repeater_store.py. May be given more than "
+                             "once. Default: data_files/rb_repeaters.rbc if "
+                             "it exists, else data_files/rb_repeaters, else "
+                             "data_files/rb_data.zip")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only rewrite the output files whose inputs "
+                             "have changed since the last incremental build")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Parse every input file, rather than using the "
+                             "parsed copies cached in data_files/.cache")
+    parser.add_argument('--parallel', action='store_true',
+                        help="When building for both radios, build them in "
+                             "separate processes at the same time")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Read up to this many RepeaterBook CSV sheets, "
+                             "and make the channels for up to this many "
+                             "radio IDs, at once, each in its own process")
+    parser.add_argument('--duplicates', choices=DUPLICATE_MODES,
+                        help="Look for analog channels with the same "
+                             "frequencies and transmit tone. 'report' lists "
+                             "them; 'merge' also leaves out the RepeaterBook "
+                             "ones that are the same site (same state, close "
+                             "together) as a RepeaterBook channel they "
+                             "duplicate, putting that channel in their zones "
+                             "instead")
+    parser.add_argument('--dup-tolerance-khz', type=float, default=0,
+                        metavar='KHZ',
+                        help="With --duplicates, count channels whose "
+                             "frequencies are within KHZ of each other as "
+                             "duplicates. Default: 0, exact matches only")
+    parser.add_argument('--state-zone-size', type=int, metavar='N',
+                        help="Split the RepeaterBook state zones with more "
+                             "than N channels into parts covering smaller "
+                             "areas. Default: the most a zone can hold")
+    parser.add_argument('--order', choices=ORDERS, default='longitude',
+                        help="How to order the RepeaterBook repeaters in "
+                             "each state zone: 'longitude', west to east; "
+                             "'distance', nearest --home first; 'route', "
+                             "along the path through the lat_long.yaml "
+                             "regions; 'hilbert', along a space-filling "
+                             "curve, so neighbours stay together. Default: "
+                             "longitude")
+    parser.add_argument('--home', type=lat_long_point, metavar='LAT,LONG',
+                        help="With --order distance, the point to measure "
+                             "from. Default: the start of the route")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running, and rebuild (incrementally) and "
+                             "remake zone_table.txt whenever the data files "
+                             "change. Stop with Ctrl-C")
+    parser.add_argument('--timings', action='store_true',
+                        help="Report the wall time, call count and memory "
+                             "allocated for each stage of the build. Work "
+                             "done in other processes isn't included.")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Profile the build with cProfile, and write the "
+                             "stats to FILE")
+    parser.add_argument('--check', action='store_true',
+                        help="Dry run: build the code plugs in memory and "
+                             "report what they would hold, and any problems, "
+                             "without writing any files")
+    return parser
+
+
+def lat_long_point(text):
+    """
+    :param text: A point given on the command line, e.g., '40.76,-111.89'.
+    :return: It as (lat, long).
+    """
+    try:
+        lat, long = (float(part) for part in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{text} is not a LAT,LONG point, e.g., 40.76,-111.89")
+    return lat, long
+
+
+def parse_args(argv=None, prog=None):
+    """
+    :param argv: The arguments to parse.  Default: the command line's.
+    :param prog: The program name for the usage message.
+    :return: None.  The global args is set.
+    """
+    global args
+    parser = make_parser(prog)
+    args = parser.parse_args(argv)
     if not (args.AT578 or args.AT878):
-        parser.error("One of AT578 or AT878 must be supplied")
+        parser.error("At least one of AT578 or AT878 must be supplied. "
+                     "Give both to build both from a single load of the "
+                     "data files.")
 
 
-def load_data_from_yaml_files():
+@timed
+def load_data_from_yaml_files(cache, data_dir=DATA_DIR):
     """
     Loads data from
         - radio_ids.yaml,
@@ -35,6 +349,8 @@ def load_data_from_yaml_files():
         - field_names.yaml,
         - lat_long.yaml,
         - zone_order.yaml
+    :param cache: The ParseCache to parse them through.
+    :param data_dir: The directory they are in.
     :return: Dicts:
                radio_ids,
                repeaters,
@@ -47,41 +363,66 @@ def load_data_from_yaml_files():
                lat_long
                zone_order
     """
-    with open('data_files/radio_ids.yaml') as f:
-        radio_ids = yaml.safe_load(f)
+    def path(name):
+        return os.path.join(data_dir, name)
+
+    radio_ids = cache.load_yaml(path('radio_ids.yaml'))
     repeaters = {}
-    for fn in glob('data_files/repeaters*'):
-        with open(fn) as f:
-            repeaters.update(yaml.safe_load(f))
-    with open('data_files/talkgroups.yaml') as f:
-        talkgroups = yaml.safe_load(f)
-    with open('data_files/simplex.yaml') as f:
-        simplex = yaml.safe_load(f)
+    for fn in glob(path('repeaters*')):
+        repeaters.update(cache.load_yaml(fn))
+    talkgroups = cache.load_yaml(path('talkgroups.yaml'))
+    simplex = cache.load_yaml(path('simplex.yaml'))
     # Simplex channels are sometimes named with their frequency, e.g., 146.52.
     # Make sure that all keys are strings.
     simplex = {(str(key) if not isinstance(key, str) else key): simplex[key]
                for key in simplex.keys()}
+    # The GROUP_ entries are expanded when the code plug is built; see
+    # compile_channel_requests().
     channel_requests = []
-    for fn in glob('data_files/channel_requests*'):
-        with open(fn) as f:
-            a = yaml.safe_load(f)
-            channel_requests += a  # FIXME
-    channel_requests = expand_channel_requests(channel_requests)
-    with open('data_files/special_zones.yaml') as f:
-        special_zones = yaml.safe_load(f)
-    with open('data_files/channel_defaults.yaml') as f:
-        channel_defaults = yaml.safe_load(f)
-    with open('data_files/field_names.yaml') as f:
-        field_names = yaml.safe_load(f)
-    with open('data_files/lat_long.yaml') as f:
-        lat_long = yaml.safe_load(f)
-    with open('data_files/zone_order.yaml') as f:
-        zone_order = yaml.safe_load(f)
+    for fn in glob(path('channel_requests*')):
+        channel_requests += cache.load_yaml(fn)  # FIXME
+    special_zones = cache.load_yaml(path('special_zones.yaml'))
+    channel_defaults = cache.load_yaml(path('channel_defaults.yaml'))
+    field_names = cache.load_yaml(path('field_names.yaml'))
+    lat_long = cache.load_yaml(path('lat_long.yaml'))
+    zone_order = cache.load_yaml(path('zone_order.yaml'))
     return radio_ids, repeaters, talkgroups, simplex, channel_requests, \
         special_zones, channel_defaults, field_names, lat_long, zone_order
 
 
-def expand_channel_requests(channel_requests):
+def load_repeater_locations(cache, repeaters, data_dir=DATA_DIR):
+    """
+    Loads the repeaters' locations, for the zone table, from the comments in
+    repeaters*.yaml.
+    :param cache: The ParseCache to read the comments through.
+    :param repeaters: The repeaters dict, as parsed from those files.
+    :param data_dir: The directory they are in.
+    :return: A dict of the locations, keyed by repeater name.
+    """
+    comments = {}
+    for fn in glob(os.path.join(data_dir, 'repeaters*')):
+        comments.update(cache.get(fn, 'comments',
+                                  lambda: comment_locations(fn)))
+    return repeater_locations(repeaters, comments)
+
+
+@timed
+def compile_channel_requests(channel_requests):
+    """
+    Compiles the channel requests, ready for channel generation.  The GROUP_
+    entries are resolved, once each, and every request's talkgroups are
+    replaced by a tuple with the groups expanded, duplicates removed, and
+    the disconnect talkgroup (TgDisc) on the end.
+
+    Groups may contain other groups.  A group that contains itself, directly
+    or through other groups, is an error.
+
+    The requests read from the YAML files are not modified; new request
+    dicts are returned.
+    :param channel_requests: The list of requests from the
+        channel_requests*.yaml files, including the GROUP_ entries.
+    :return: A list of the compiled requests, without the GROUP_ entries.
+    """
     # First segregate the group entries from the non-groups.
     groups = {}
     non_groups = []
@@ -94,81 +435,232 @@ def expand_channel_requests(channel_requests):
         if not was_group:
             non_groups.append(request_dict)
 
-    # If there weren't any GROUP_xxx entries, we're done.
-    if not groups:
-        return channel_requests
-
-    # OK, we have groups.  They may or may not be used,but we have to walk all
-    # the talkgroup requests and insert the group contents in place of the
-    # group reference.
-    expanded_requests = []
+    resolved_groups = {}
+    compiled_requests = []
     for request_dict in non_groups:
-        if 'T' in request_dict.keys():
-            # The request has talk groups.  They may be groups of groups, and
-            # need expanding.
-            # Note that if there are no talk groups in the request (not T key),
-            # we don't need to do anything.
-            talkgroups = request_dict['T']
-            expanded_requests = []
-            for talkgroup in talkgroups:
-                if talkgroup.startswith('GROUP_'):
-                    expanded_requests = expanded_requests + groups[talkgroup]
-                else:
-                    expanded_requests.append(talkgroup)
-            request_dict['T'] = expanded_requests
-
-    return non_groups
-
-
-def fix_list_members(dict_list):
-    """
-    dict_list is a list of dicts.  Some elements of each dict may be a list.
-    Since we are writing a csv we have to flatten those lists into a scalar
-    element.  The CPS software expects the list elements to be a pipe-separated
-    single string.
-    :param dict_list: a list of dicts.
-    :return: a list of dicts, with dict members that were lists now single
-        strings with the former list elements separated by pipe.
-    """
-    for this_dict in dict_list:
-        for dict_key in this_dict.keys():
-            dict_element = this_dict[dict_key]
-            if type(dict_element) == list:
-                this_dict[dict_key] = '|'.join(dict_element)
-    return dict_list
-
-
-def write_dict_to_csv(dict_list_to_write, file_name, field_names):
-    # Determine the correct output directory
-    if args.AT578:
-        dir = '../578'
-    else:
-        dir = '../878'
-    index_dict_list(dict_list_to_write)
-    fix_list_members(dict_list_to_write)
-    with open(os.path.join(dir, file_name), 'w', newline='') as f:
-        writer = csv.DictWriter(f,
-                                fieldnames=field_names,
-                                extrasaction='ignore',
-                                quoting=csv.QUOTE_ALL,
-                                quotechar='"')
-        writer.writeheader()
-        for row in dict_list_to_write:
-            writer.writerow(row)
+        compiled = dict(request_dict)
+        if 'T' in compiled:
+            # The request has talk groups.  Note that if there are no talk
+            # groups in the request (not T key), we don't need to do anything.
+            talkgroups = expand_talkgroups(compiled['T'], groups,
+                                           resolved_groups, [])
+            # Have a disconnect in every group with digital repeaters.
+            if 'TgDisc' not in talkgroups:
+                talkgroups += ('TgDisc',)
+            compiled['T'] = talkgroups
+        compiled_requests.append(compiled)
+    return compiled_requests
+
+
+def expand_talkgroups(talkgroups, groups, resolved_groups, resolving):
+    """
+    Expands a list of talkgroups, some of which may be GROUP_ names.
+    :param talkgroups: A list of talkgroup and GROUP_ names.
+    :param groups: A dict of the GROUP_ entries' talkgroup lists, keyed by
+        group name.
+    :param resolved_groups: A dict of the groups already expanded, keyed by
+        group name.  Groups expanded here are added to it.
+    :param resolving: The groups being expanded, outermost first, for
+        detecting groups that contain themselves.
+    :return: A tuple of talkgroup names, in the order first listed, without
+        duplicates.
+    """
+    expanded = {}
+    for talkgroup in talkgroups:
+        if not talkgroup.startswith('GROUP_'):
+            expanded[talkgroup] = None
+            continue
+        if talkgroup not in resolved_groups:
+            if talkgroup in resolving:
+                raise ValueError("Talkgroup group contains itself: " +
+                                 ' -> '.join(resolving + [talkgroup]))
+            try:
+                members = groups[talkgroup]
+            except KeyError:
+                raise ValueError(f"Unknown talkgroup group {talkgroup}")
+            resolved_groups[talkgroup] = expand_talkgroups(
+                members, groups, resolved_groups, resolving + [talkgroup])
+        expanded.update(dict.fromkeys(resolved_groups[talkgroup]))
+    return tuple(expanded)
+
+
+def input_files():
+    """
+    :return: A list of all the files the build reads.
+    """
+    from repeaters_from_repeaterbook import repeaterbook_files
+    return glob(os.path.join(DATA_DIR, '*.yaml')) + \
+        repeaterbook_files(args.repeaterbook)
+
+
+def fix_list_member(dict_element):
+    """
+    Some elements of the dicts we write may be a list.  Since we are writing a
+    csv we have to flatten those lists into a scalar element.  The CPS
+    software expects the list elements to be a pipe-separated single string.
+    :param dict_element: a dict member
+    :return: The member, or if it was a list, a single string with the former
+        list elements separated by pipe.
+    """
+    if type(dict_element) == list:
+        return '|'.join(dict_element)
+    return dict_element
+
+
+def csv_rows(dicts_to_write, field_names):
+    """
+    Turns dicts into CSV rows one at a time, as they are produced.  Each row
+    is given its "No." as it goes by, and list members are flattened.  The
+    dicts themselves are not changed.
+    :param dicts_to_write: An iterable of dicts, e.g., a list or a generator.
+    :param field_names: The CSV column names.
+    :return: Yields a list of column values for each dict.  Columns missing
+        from a dict are empty.
+    """
+    for i, this_dict in enumerate(dicts_to_write):
+        row = [fix_list_member(this_dict.get(field_name, ''))
+               for field_name in field_names]
+        if 'No.' in field_names:
+            row[field_names.index('No.')] = str(i + 1)
+        yield row
 
 
-def index_dict_list(dictionary_list):
+def csv_text(value):
     """
-    Once the channels list is completely populated, add the "No." field to
-    each entry.
-    :param dictionary_list: The fully populated dictionary.
-    :return: None. The dictionary is updated.
+    :param value: A value from a table.
+    :return: The value as text, as csv.writer would write it.  Lists are
+        flattened, as by fix_list_member().
     """
-    for i, row in enumerate(dictionary_list):
-        row["No."] = str(i + 1)
+    if type(value) is str:
+        return value
+    if value is None:
+        return ''
+    return str(fix_list_member(value))
 
 
-def make_talkgroup_file(talkgroups):
+def csv_line(values):
+    """
+    :param values: A row's values, as text.
+    :return: The row as a line of CSV, with every value quoted, exactly as
+        csv.writer(quoting=csv.QUOTE_ALL) writes it.
+    """
+    line = '","'.join(values)
+    if '"' in line:
+        line = '","'.join(value.replace('"', '""') for value in values)
+    return '"' + line + '"\r\n'
+
+
+class CsvLayout:
+    """
+    A table's CSV columns (from field_names.yaml), worked out once, for
+    writing the table quickly.  The output is the same as from csv.writer
+    with every value quoted, which is what AnyTone CPS wants.
+
+    Each row is made into one line of text, and the lines are written
+    CSV_BATCH_SIZE at a time.  Most of a channel's fifty or so columns are
+    its defaults, which are the same for every channel, so their text is
+    made once per table; each channel then only fills in the handful of
+    fields it has set.
+    """
+    def __init__(self, field_names):
+        self.field_names = list(field_names)
+        self.columns = {name: i for i, name in enumerate(self.field_names)}
+        self.number_column = self.columns.get('No.')
+        self.header = csv_line(self.field_names)
+
+    def row(self, this_dict, default_rows):
+        """
+        :param this_dict: A dict, or a Channel.
+        :param default_rows: A dict in which to keep the text of each
+            Channel defaults dict's row, keyed by its id.
+        :return: The row's values, as text, in column order.  Columns
+            missing from the dict are empty.
+        """
+        if type(this_dict) is not Channel:
+            return [csv_text(this_dict.get(field_name, ''))
+                    for field_name in self.field_names]
+        defaults, fields = this_dict.layers()
+        try:
+            row = default_rows[id(defaults)].copy()
+        except KeyError:
+            row = [csv_text(defaults.get(field_name, ''))
+                   for field_name in self.field_names]
+            default_rows[id(defaults)] = row
+            row = row.copy()
+        columns = self.columns
+        for field_name, value in fields.items():
+            column = columns.get(field_name)
+            if column is not None:
+                row[column] = csv_text(value)
+        return row
+
+    def lines(self, dicts_to_write):
+        """
+        :param dicts_to_write: An iterable of dicts, e.g., a list or a
+            generator.
+        :return: Yields a line of CSV for each dict, numbered in the "No."
+            column, if there is one.
+        """
+        # Only kept while the table is being written, so a defaults dict
+        # can't be freed and its id reused while it is here.
+        default_rows = {}
+        number_column = self.number_column
+        for i, this_dict in enumerate(dicts_to_write):
+            row = self.row(this_dict, default_rows)
+            if number_column is not None:
+                row[number_column] = str(i + 1)
+            yield csv_line(row)
+
+    def write(self, dicts_to_write, f):
+        """
+        Writes dicts as CSV to an open file, after the row of column names.
+        :param dicts_to_write: An iterable of dicts, e.g., a list or a
+            generator.  The lines are written as the dicts are produced.
+        :param f: The file, opened with newline=''.
+        :return: None
+        """
+        f.write(self.header)
+        lines = self.lines(dicts_to_write)
+        while True:
+            batch = ''.join(islice(lines, CSV_BATCH_SIZE))
+            if not batch:
+                break
+            f.write(batch)
+
+
+def write_dict_to_csv(dicts_to_write, file_name, field_names, dir):
+    """
+    Writes dicts to a CSV file.  The rows are written as the dicts are
+    produced, so dicts_to_write can be a generator, and the rows never all
+    need to be in memory at once.
+    :param dicts_to_write: An iterable of dicts, e.g., a list or a generator.
+    :param file_name: The CSV file name
+    :param field_names: The CSV column names, in order, or a CsvLayout of
+        them.
+    :param dir: The directory to write the file to.
+    :return: None
+    """
+    with timing.timer.stage('write_dict_to_csv ' + file_name), \
+            open(os.path.join(dir, file_name), 'w', newline='') as f:
+        write_csv(dicts_to_write, field_names, f)
+
+
+def write_csv(dicts_to_write, field_names, f):
+    """
+    Writes dicts as CSV to an open file, e.g., a file or io.StringIO.
+    :param dicts_to_write: An iterable of dicts, e.g., a list or a generator.
+    :param field_names: The CSV column names, in order, or a CsvLayout of
+        them.
+    :param f: The file, opened with newline=''.
+    :return: None
+    """
+    if not isinstance(field_names, CsvLayout):
+        field_names = CsvLayout(field_names)
+    field_names.write(dicts_to_write, f)
+
+
+@timed
+def make_talkgroup_file(talkgroups, dir):
     """
     The 878 requires duplicate information in multiple tables.  In the
     channels table, it requires the talkgroup name and number, but those are
@@ -179,12 +671,21 @@ def make_talkgroup_file(talkgroups):
     :param talkgroups: the dict of talkgroups as read from the talkgroups
         YAML file. Most values are scalars, but for Private Call talkgroups,
         the value is itself a dict.
+    :param dir: The directory to write the file to.
     :return: None
     """
+    # Now write it out.
+    write_dict_to_csv(talkgroup_dicts(talkgroups), 'talkgroups.csv',
+                      TALKGROUP_FIELD_NAMES, dir)
+
+
+def talkgroup_dicts(talkgroups):
+    """
+    Turns the talkgroups into dicts with the columns that AnyTone CPS wants.
+    :param talkgroups: the dict of talkgroups, as for make_talkgroup_file().
+    :return: Yields a dict for each talkgroup, sorted by talkgroup name.
+    """
     tg_keys = sorted(talkgroups.keys())
-    # Need to turn this into a list of dicts, with the columns that AnyTone CPS
-    # wants
-    tg_list = []
     for tg_key in tg_keys:
         tg_value = talkgroups[tg_key]
         # Assume Group Call; we'll overwrite if not.
@@ -195,19 +696,56 @@ def make_talkgroup_file(talkgroups):
             if tg_value['Private']:
                 tg['Call Type'] = 'Private Call'
             tg['Radio ID'] = tg_value['Number']
-        tg_list.append(tg)
+        yield tg
 
-    # Now write it out.
-    field_names = ['No.', "Radio ID", "Name", "Call Type", "Call Alert"]
-    write_dict_to_csv(tg_list, 'talkgroups.csv', field_names)
+
+def shared_channel(shared_channels, key, make):
+    """
+    Looks up a channel that is the same for every radio, making it if it
+    hasn't been made yet.  Channels aren't changed once they are made, so
+    the builds for each radio can share them.
+    :param shared_channels: A dict of the channels already made, or None
+        to make the channel regardless.
+    :param key: The channel's key in shared_channels.
+    :param make: A function of no arguments that makes the channel.
+    :return: The channel.
+    """
+    if shared_channels is None:
+        return make()
+    try:
+        return shared_channels[key]
+    except KeyError:
+        channel = shared_channels[key] = make()
+        return channel
 
 
 def make_analog_repeater_channel(channels,
                                  channels_by_name,
                                  repeater,
                                  channel_defaults,
-                                 zones):
-    channel = channel_defaults.copy()
+                                 zones,
+                                 shared_channels=None):
+    channel = shared_channel(shared_channels, ('R', repeater['Name']),
+                             lambda: analog_repeater_channel(
+                                 repeater, channel_defaults))
+    channels.append(channel)
+    channels_by_name[channel['Channel Name']] = channel
+    try:
+        state = repeater['State']
+    except KeyError:
+        # Use the generic "Ana Rptrs"
+        state = 'Ana Rptrs'
+    insert_into_zones(channel, zones, state=state)
+
+
+def analog_repeater_channel(repeater, channel_defaults):
+    """
+    :param repeater: An analog repeater dict, from the repeaters_xxx.yaml
+        files.
+    :param channel_defaults: The dict of default channel settings.
+    :return: Its Channel.
+    """
+    channel = Channel(channel_defaults)
     channel['Repeater Name'] = repeater['Name']
     channel['Channel Name'] = repeater['Name']
     channel['Transmit Frequency'] = '{:<09}'.format(repeater['TX'])
@@ -236,22 +774,18 @@ def make_analog_repeater_channel(channels,
 
     if 'Squelch Mode' in keys:
         channel['Squelch Mode'] = repeater['Squelch Mode']
-
-    channels.append(channel)
-    channels_by_name[channel['Channel Name']] = channel
-    try:
-        state = repeater['State']
-    except KeyError:
-        # Use the generic "Ana Rptrs"
-        state = 'Ana Rptrs'
-    insert_into_zones(channel, zones, state=state)
+    return channel
 
 
+@timed
 def make_analog_repeater_from_repeaterbook_channels(repeaters,
                                                     channels,
                                                     channels_by_name,
                                                     channel_defaults,
-                                                    zones):
+                                                    zones,
+                                                    target,
+                                                    duplicate_finder=None,
+                                                    made_channels=None):
     """
     This is a special channel making routine for repeaters we have mass
     harvested from Repeaterbook based on geography.
@@ -265,54 +799,111 @@ def make_analog_repeater_from_repeaterbook_channels(repeaters,
     :param channels_by_name: The channels_by_name dict.
     :param channel_defaults: The dict of default channel settings.
     :param zones: The zones list
+    :param target: The Target radio
+    :param duplicate_finder: If given, a DuplicateFinder to check the
+        channels with, with their RepeaterBook state and position.  A
+        channel it says to merge (one at the same site as an earlier one)
+        is not made; the channel it duplicates goes in its zone, and is
+        found under its name.
+    :param made_channels: The channels already made for the repeaters by
+        repeaterbook_channel(), in the same order, to use rather than making
+        them again.  Default: make them.
     :return: The channels dict, the channels_by_name dict.
     """
-    for repeater in repeaters:
+    for i, repeater in enumerate(repeaters):
         # Skip 220 band for 878.
-        if args.AT878 and 200.0 < float(repeater['RX']) < 400.0:
+        if target.skips(repeater):
             continue
-        channel = channel_defaults.copy()
-        channel['Repeater Name'] = repeater['Name']
-        channel['Channel Name'] = repeater['Name']
-        channel['Transmit Frequency'] = '{:<09}'.format(repeater['TX'])
-        channel['Receive Frequency'] = '{:<09}'.format(repeater['RX'])
-        channel['Channel Type'] = 'A-Analog'
-        channel['Band Width'] = '25K'
-        channel['Busy Lock/TX Permit'] = 'Off'
-
-        keys = repeater.keys()
-        # Can't specify both CTCSS (both dirs) and either RCTCSS or TCTCSS
-        if 'CTCSS' in keys and ('RCTCSS' in keys or 'TCTCSS' in keys):
-            raise KeyError
-        if 'CTCSS' in keys:
-            channel["CTCSS/DCS Encode"] = repeater['CTCSS']
-        if 'RCTCSS' in keys:
-            channel["CTCSS/DCS Encode"] = repeater['RCTCSS']
-        if 'TCTCSS' in keys:
-            channel["CTCSS/DCS Decode"] = repeater['TCTCSS']
-        if 'RO' in keys and repeater['RO']:
-            channel['PTT Prohibit'] = 'True'
-
+        if made_channels is None:
+            channel = repeaterbook_channel(repeater, channel_defaults)
+        else:
+            channel = made_channels[i]
+
+        state = repeaterbook_zone_name(repeater)
+        if duplicate_finder is not None:
+            original = duplicate_finder.check(
+                channel, can_merge=True,
+                site=(repeater['State'], repeater['Lat'], repeater['Long']))
+            if original is not None:
+                channels_by_name.setdefault(channel['Channel Name'], original)
+                insert_into_zones(original, zones, state=state)
+                continue
         channels.append(channel)
         channels_by_name[channel['Channel Name']] = channel
-        try:
-            state = repeater['State']
-        except KeyError:
-            # Use the generic "Ana Rptrs"
-            state = 'Ana Rptrs'
-        if state == 'Montana':
-            state = 'Ana Rptrs'
         insert_into_zones(channel, zones, state=state)
     return channels, channels_by_name
 
 
+def repeaterbook_channel(repeater, channel_defaults):
+    """
+    :param repeater: A repeater from RepeaterBook.
+    :param channel_defaults: The dict of default channel settings.
+    :return: Its Channel.
+    """
+    channel = Channel(channel_defaults)
+    channel['Repeater Name'] = repeater['Name']
+    channel['Channel Name'] = repeater['Name']
+    channel['Transmit Frequency'] = '{:<09}'.format(repeater['TX'])
+    channel['Receive Frequency'] = '{:<09}'.format(repeater['RX'])
+    channel['Channel Type'] = 'A-Analog'
+    channel['Band Width'] = '25K'
+    channel['Busy Lock/TX Permit'] = 'Off'
+
+    keys = repeater.keys()
+    # Can't specify both CTCSS (both dirs) and either RCTCSS or TCTCSS
+    if 'CTCSS' in keys and ('RCTCSS' in keys or 'TCTCSS' in keys):
+        raise KeyError
+    if 'CTCSS' in keys:
+        channel["CTCSS/DCS Encode"] = repeater['CTCSS']
+    if 'RCTCSS' in keys:
+        channel["CTCSS/DCS Encode"] = repeater['RCTCSS']
+    if 'TCTCSS' in keys:
+        channel["CTCSS/DCS Decode"] = repeater['TCTCSS']
+    if 'RO' in keys and repeater['RO']:
+        channel['PTT Prohibit'] = 'True'
+    return channel
+
+
+def repeaterbook_zone_name(repeater):
+    """
+    :param repeater: A repeater from RepeaterBook.
+    :return: The name of the zone for it: its state, except that Montana's
+        go in with our own analog repeaters.
+    """
+    try:
+        state = repeater['State']
+    except KeyError:
+        # Use the generic "Ana Rptrs"
+        state = 'Ana Rptrs'
+    if state == 'Montana':
+        state = 'Ana Rptrs'
+    return state
+
+
 def make_analog_simplex_channel(channels,
                                 channels_by_name,
                                 simplex_name,
                                 simplex_channel,
                                 channel_defaults,
-                                zones):
-    channel = channel_defaults.copy()
+                                zones,
+                                shared_channels=None):
+    channel = shared_channel(shared_channels, ('S', simplex_name),
+                             lambda: analog_simplex_channel(
+                                 simplex_name, simplex_channel,
+                                 channel_defaults))
+    channels.append(channel)
+    channels_by_name[simplex_name] = channel
+    insert_into_zones(channel, zones)
+
+
+def analog_simplex_channel(simplex_name, simplex_channel, channel_defaults):
+    """
+    :param simplex_name: The channel's name.
+    :param simplex_channel: Its analog simplex dict, from simplex.yaml.
+    :param channel_defaults: The dict of default channel settings.
+    :return: Its Channel.
+    """
+    channel = Channel(channel_defaults)
     channel['Channel Name'] = simplex_name
     channel['Transmit Frequency'] = '{:<09}'.format(simplex_channel['Freq'])
     channel['Receive Frequency'] = '{:<09}'.format(simplex_channel['Freq'])
@@ -324,23 +915,22 @@ def make_analog_simplex_channel(channels,
     if simplex_name == "APRS":
         channel['APRS RX'] = 'On'
         channel['APRS Report Type'] = 'Analog'
-    channels.append(channel)
-    channels_by_name[simplex_name] = channel
-    insert_into_zones(channel, zones)
+    return channel
 
 
 def make_digital_repeater_channel(channels,
                                   channels_by_name,
                                   repeater,
+                                  decorated_name,
                                   talkgroup,
                                   talkgroup_number,
                                   channel_defaults,
                                   zones,
                                   radio_id,
                                   single_radio_id):
-    channel = channel_defaults.copy()
+    channel = Channel(channel_defaults)
     channel['Repeater Name'] = repeater['Name']
-    channel_name = repeater['Decorated Name'] + ' ' + talkgroup
+    channel_name = decorated_name + ' ' + talkgroup
     # Channel names are limited to 16 characters.
     if len(channel_name) > 16:
         print(f"Truncating channel name '{channel_name}' to '{channel_name[:16]}")
@@ -391,22 +981,21 @@ def make_digital_repeater_channel(channels,
 def make_digital_repeater_channels(channels,
                                    channels_by_name,
                                    repeater,
+                                   decorated_name,
                                    talkgroups,
                                    channel_request,
                                    channel_defaults,
                                    zones,
                                    radio_id,
                                    single_radio_id):
-    # Have a disconnect in every group with digital repeaters.
-    # The reason we do it conditionally is that we come through here once for
-    # every radio_id.
-    if 'TgDisc' not in channel_request['T']:
-        channel_request['T'].append('TgDisc')
+    # The talkgroups were expanded, and TgDisc added, by
+    # compile_channel_requests().
     for talkgroup in channel_request['T']:
         try:
             make_digital_repeater_channel(channels,
                                           channels_by_name,
                                           repeater,
+                                          decorated_name,
                                           talkgroup,
                                           talkgroups[talkgroup],
                                           channel_defaults,
@@ -429,7 +1018,7 @@ def make_digital_simplex_channel(channels,
     if not single_radio_id:
         simplex_name = radio_id['Abbrev'] + ' ' + simplex_name
 
-    channel = channel_defaults.copy()
+    channel = Channel(channel_defaults)
     channel['Channel Name'] = simplex_name
     channel['Transmit Frequency'] = '{:<09}'.format(simplex_channel['Freq'])
     channel['Receive Frequency'] = '{:<09}'.format(simplex_channel['Freq'])
@@ -449,38 +1038,43 @@ def make_digital_simplex_channel(channels,
     insert_into_zones(channel, zones, radio_id, single_radio_id)
 
 
-def decorate_repeater_name(repeater, radio_id, single_radio_id):
+def decorated_repeater_name(repeater, radio_id, single_radio_id):
     """
-    Creates a new repeater dict member, "Decorated Name". If a
-    repeater is digital and we are not programming a single radio id, then
-    the decorated name is constructed with a prefix from the radio_id
-    dict.  Otherwise the repeater's decorated name is simply the repeater name.
-    We're tracking both names because channels use the decorated name, but
-    zones do not.
+    Makes a repeater's "decorated name". If a repeater is digital and we are
+    not programming a single radio id, then the decorated name is
+    constructed with a prefix from the radio_id dict.  Otherwise the
+    decorated name is simply the repeater name.  We're tracking both names
+    because channels use the decorated name, but zones do not.  The
+    repeater dict isn't changed, so the same data can be built from again.
     :param repeater: a repeater dict
     :param radio_id: A radioid dict
     :param single_radio_id: True if we're programming a single radio ID.
-    :return: None
+    :return: The decorated name.
     """
     if repeater['Mode'] == 'D' and not single_radio_id:
-        repeater['Decorated Name'] = \
-            radio_id['Abbrev'] + ' ' + repeater['Name']
-    else:
-        repeater['Decorated Name'] = repeater['Name']
+        return radio_id['Abbrev'] + ' ' + repeater['Name']
+    return repeater['Name']
 
 
+@timed
 def make_channels(repeaters,
                   talkgroups,
                   simplex,
                   channel_requests,
                   channel_defaults,
                   zones,
-                  radio_ids):
+                  radio_ids,
+                  target,
+                  jobs=1,
+                  shared_channels=None):
     """
     Walks over the desired channels list specified in channel_info, and builds
     the dictionary of all the channels, ready to be written to a CSV file for
     import into the programmer.
 
+    The channels for each radio ID are made separately, possibly in parallel,
+    by make_radio_id_channels(), then merged in radio ID order.
+
     :param repeaters: A dict of repeater info
     :param talkgroups: A dict of talkgroup info
     :param simplex: A dict of simplex channels
@@ -490,69 +1084,167 @@ def make_channels(repeaters,
     :param zones: A dict into which zone info will be entered.
     :param radio_ids: a list of dicts (possibly of length one), containing
         information about the radio IDs to be programmed into the radio.
+    :param target: The Target radio
+    :param jobs: How many radio IDs' channels to make at once, each in its
+        own process.
+    :param shared_channels: A dict of the analog channels already made, for
+        another radio or radio ID, to use rather than making them again;
+        see shared_channel().  Those made are added to it.  Default: make
+        them all.
     :return: A list of fully populated dicts for writing to a CSV
     """
-
+    single_radio_id = len(radio_ids) == 1
+    jobs = min(jobs, len(radio_ids))
+    if jobs > 1:
+        # Each process would get, and add to, its own copy of
+        # shared_channels, so there's nothing to share.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(make_radio_id_channels,
+                                        repeat(repeaters),
+                                        repeat(talkgroups),
+                                        repeat(simplex),
+                                        repeat(channel_requests),
+                                        repeat(channel_defaults),
+                                        radio_ids,
+                                        repeat(single_radio_id),
+                                        repeat(target)))
+    else:
+        results = [make_radio_id_channels(repeaters,
+                                          talkgroups,
+                                          simplex,
+                                          channel_requests,
+                                          channel_defaults,
+                                          radio_id,
+                                          single_radio_id,
+                                          target,
+                                          shared_channels)
+                   for radio_id in radio_ids]
+    return merge_radio_id_channels(results, zones)
+
+
+def make_radio_id_channels(repeaters,
+                           talkgroups,
+                           simplex,
+                           channel_requests,
+                           channel_defaults,
+                           radio_id,
+                           single_radio_id,
+                           target,
+                           shared_channels=None):
+    """
+    Makes the channels for a single radio ID.  This is independent of the
+    other radio IDs, so they can be done in parallel.  The analog channels,
+    which are the same for every radio ID, are entered every time (taken
+    from shared_channels, if given); they are dropped when the radio IDs
+    are merged.
+    :param repeaters: A dict of repeater info
+    :param talkgroups: A dict of talkgroup info
+    :param simplex: A dict of simplex channels
+    :param channel_requests: A dict of desired channels
+    :param channel_defaults: A dict with the default values for the channels
+        CSV value
+    :param radio_id: The radio ID dict.
+    :param single_radio_id: True if this is the radio's only radio ID
+    :param target: The Target radio
+    :param shared_channels: A dict of the analog channels already made; see
+        make_channels().
+    :return: The list of channels, and a dict of Zones containing them.
+    """
     channels = []
     channels_by_name = {}
-    for radio_id in radio_ids:
-        single_radio_id = len(radio_ids) == 1
-        for channel_request in channel_requests:
-            if 'R' in channel_request.keys():
-                repeater = repeaters[channel_request['R']]
-                # Don't include 220 repeaters for 878
-                if args.AT878 and 200.0 < float(repeater['RX']) < 400.0:
-                    continue
+    zones = {}
+    for channel_request in channel_requests:
+        if 'R' in channel_request.keys():
+            repeater = repeaters[channel_request['R']]
+            # Don't include 220 repeaters for 878
+            if target.skips(repeater):
+                continue
 
-                decorate_repeater_name(repeater, radio_id, single_radio_id)
-                if repeater['Mode'] == 'D':
-                    make_digital_repeater_channels(channels,
-                                                   channels_by_name,
-                                                   repeater,
-                                                   talkgroups,
-                                                   channel_request,
-                                                   channel_defaults,
-                                                   zones,
-                                                   radio_id,
-                                                   single_radio_id)
-                elif repeater['Mode'] == 'A':
-                    # Only enter analog channels once, not per-radio_id.
-                    if repeater['Name'] in channels_by_name.keys():
-                        continue
-                    make_analog_repeater_channel(channels,
-                                                 channels_by_name,
-                                                 repeater,
-                                                 channel_defaults,
-                                                 zones)
-                else:
-                    raise ValueError("Repeater mode must be 'A' or 'D'.")
-            elif 'S' in channel_request.keys():
-                simplex_name = channel_request['S']
-                if type(simplex_name) == float:
-                    simplex_name = str(simplex_name)
-                simplex_channel = simplex[simplex_name]
-                if simplex_channel['Mode'] == 'A':
-                    # Only enter analog channels once, not per-radio_id.
-                    if simplex_name in channels_by_name.keys():
-                        continue
-                    make_analog_simplex_channel(channels,
-                                                channels_by_name,
-                                                simplex_name,
-                                                simplex_channel,
-                                                channel_defaults,
-                                                zones)
-                else:
-                    make_digital_simplex_channel(channels,
-                                                 channels_by_name,
-                                                 simplex_name,
-                                                 simplex_channel,
-                                                 channel_defaults,
-                                                 zones,
-                                                 radio_id,
-                                                 single_radio_id)
+            if repeater['Mode'] == 'D':
+                make_digital_repeater_channels(channels,
+                                               channels_by_name,
+                                               repeater,
+                                               decorated_repeater_name(
+                                                   repeater, radio_id,
+                                                   single_radio_id),
+                                               talkgroups,
+                                               channel_request,
+                                               channel_defaults,
+                                               zones,
+                                               radio_id,
+                                               single_radio_id)
+            elif repeater['Mode'] == 'A':
+                # Only enter analog channels once.
+                if repeater['Name'] in channels_by_name.keys():
+                    continue
+                make_analog_repeater_channel(channels,
+                                             channels_by_name,
+                                             repeater,
+                                             channel_defaults,
+                                             zones,
+                                             shared_channels)
+            else:
+                raise ValueError("Repeater mode must be 'A' or 'D'.")
+        elif 'S' in channel_request.keys():
+            simplex_name = channel_request['S']
+            if type(simplex_name) == float:
+                simplex_name = str(simplex_name)
+            simplex_channel = simplex[simplex_name]
+            if simplex_channel['Mode'] == 'A':
+                # Only enter analog channels once.
+                if simplex_name in channels_by_name.keys():
+                    continue
+                make_analog_simplex_channel(channels,
+                                            channels_by_name,
+                                            simplex_name,
+                                            simplex_channel,
+                                            channel_defaults,
+                                            zones,
+                                            shared_channels)
+            else:
+                make_digital_simplex_channel(channels,
+                                             channels_by_name,
+                                             simplex_name,
+                                             simplex_channel,
+                                             channel_defaults,
+                                             zones,
+                                             radio_id,
+                                             single_radio_id)
+    return channels, zones
+
+
+def merge_radio_id_channels(results, zones):
+    """
+    Merges the channels and zones made for each radio ID, in radio ID order.
+    The result is the same as making them all in one pass: analog channels
+    are only entered once, not per-radio_id, and each zone's members are in
+    the order they were added.
+    :param results: A list of (channels, zones) from make_radio_id_channels(),
+        in radio ID order.
+    :param zones: The dict of Zones to merge the zones into.
+    :return: The channels list, the channels_by_name dict.
+    """
+    channels = []
+    channels_by_name = {}
+    for radio_id_channels, radio_id_zones in results:
+        for channel in radio_id_channels:
+            if channel['Channel Type'] == 'A-Analog' and \
+                    channel['Channel Name'] in channels_by_name:
+                continue
+            channels.append(channel)
+            channels_by_name[channel['Channel Name']] = channel
+        for zone_name, radio_id_zone in radio_id_zones.items():
+            try:
+                zone = zones[zone_name]
+            except KeyError:
+                zone = Zone(zone_name)
+                zones[zone_name] = zone
+            zone.extend(radio_id_zone)
     return channels, channels_by_name
 
 
+@timed
 def add_special_zone_members(channels_by_name,
                              special_zones,
                              zones,
@@ -560,18 +1252,15 @@ def add_special_zone_members(channels_by_name,
                              single_radio_id):
     # It is possible that a channel to be added here is already in the zone.
     # We'll filter those out in insert_into_zone().
+    # The channels for the special key "ALL_ZONES" are the same for every
+    # radio_id, so only look them up once.
+    chans_for_all_zones = [channels_by_name[str(chan)]
+                           for chan in special_zones['ALL_ZONES']]
     for radio_id in radio_ids:
         # First handle the special key "ALL_ZONES":
-        chans_for_all_zones = special_zones['ALL_ZONES']
-        for zone_key in zones.keys():
+        for zone in zones.values():
             for chan in chans_for_all_zones:
-                if type(chan) != str:
-                    chan = str(chan)
-                insert_into_zone(channels_by_name[chan],
-                                 zone_key,
-                                 zones,
-                                 radio_id,
-                                 single_radio_id)
+                zone.add(chan)
         # Now the channels that only go into certain zones.
         for zone_name in special_zones.keys():
             if zone_name == 'ALL_ZONES':
@@ -619,7 +1308,7 @@ def insert_into_zones(channel, zones, radio_id=None, state='Ana Rptrs',
     will be none.
 
     :param channel: A channel
-    :param zones: A dict of dicts containing info about the zones.
+    :param zones: A dict of Zones, keyed by zone name.
     :param radio_id: A radio_id dict. All we will use is the Abbrev field.
     :param state: The US State (or other geographic region) in which the
         repeater is located.
@@ -646,102 +1335,722 @@ def insert_into_zone(channel, zone_key, zones, radio_id, single_radio_id=True):
     try:
         this_zone = zones[zone_key]
     except KeyError:
-        this_zone = {
-            'Zone Name': zone_key,
-            'Zone Channel Member': [],
-            'Zone Channel Member RX Frequency': [],
-            'Zone Channel Member TX Frequency': []
-        }
+        this_zone = Zone(zone_key)
         zones[zone_key] = this_zone
 
-    channel_name = channel['Channel Name']
-
-    # Don't enter a channel already in the zone.
-    if channel_name in this_zone['Zone Channel Member']:
-        return
-
-    this_zone['Zone Channel Member'].append(channel_name)
-    this_zone['Zone Channel Member RX Frequency'].append(
-        channel['Receive Frequency'])
-    this_zone['Zone Channel Member TX Frequency'].append(
-        channel['Transmit Frequency'])
-    if len(this_zone['Zone Channel Member']) == 1:
-        this_zone['A Channel'] = channel_name
-        this_zone['A Channel RX Frequency'] = channel['Receive Frequency']
-        this_zone['A Channel TX Frequency'] = channel['Transmit Frequency']
-    if len(this_zone['Zone Channel Member']) == 2:
-        this_zone['B Channel'] = channel_name
-        this_zone['B Channel RX Frequency'] = channel['Receive Frequency']
-        this_zone['B Channel TX Frequency'] = channel['Transmit Frequency']
+    # Zone.add() won't enter a channel already in the zone.
+    this_zone.add(channel)
 
 
 def change_zone_dict_to_list(zone_dict, zone_order):
     """
     Because we had to add channels to zones based on zone name, the zone
     data are currently stored in a dict, with the keys being the zone name.
-    The elements of this dict are also dicts, containing all the information
+    The elements of this dict are Zone objects, containing all the information
     for the zone--including the zone name.
 
     In order to write this information to a csv, we have to convert from a
-    dict of dicts to a list of dicts, dropping the redundant outer key.
-    :param zone_dict: A dict of dicts containing zone information.
+    dict of Zones to a sequence of dicts, dropping the redundant outer key.
+    The zone dicts are made one at a time, as the CSV writer wants them.
+    :param zone_dict: A dict of Zones, keyed by zone name.
     :param zone_order: A list of the order in which to emit the zones.
-    :return: A list of dicts containing zone information.
+    :return: Yields dicts containing zone information.
     """
-    zone_list = []
-    # Process the zones we especially care about ordering.
-    for zone in zone_order:
-        zone_list.append(zone_dict[zone])
-        del(zone_dict[zone])
+    for zone in zone_names_in_order(zone_dict, zone_order):
+        yield zone_dict[zone].to_dict()
 
-    # And now handle the remaining zones in alphabetic order
-    for zone in sorted(zone_dict.keys()):
-        zone_list.append(zone_dict[zone])
-    return zone_list
 
+def zone_names_in_order(zone_dict, zone_order, split_zones=None):
+    """
+    :param zone_dict: A dict of Zones, keyed by zone name.
+    :param zone_order: A list of the zones to put first, in order.
+    :param split_zones: The state zones split into parts, as returned by
+        split_state_zones(), so the parts can be kept in number order.
+    :return: A list of all the zone names, in the order they are written to
+        zones.csv.
+    """
+    # The zones we especially care about ordering come first.
+    zone_names = list(zone_order)
+
+    # And then the remaining zones in alphabetic order
+    ordered_zones = set(zone_order)
+    split_parts = {part: (zone_name, number)
+                   for zone_name, parts in (split_zones or {}).items()
+                   for number, part in enumerate(parts, 1)}
+    for zone in sorted(zone_dict.keys(),
+                       key=lambda name: zone_sort_key(name, split_parts)):
+        if zone not in ordered_zones:
+            zone_names.append(zone)
+    return zone_names
+
+
+def zone_sort_key(zone_name, split_parts):
+    """
+    Sort key putting the parts of a split zone in number order, e.g.,
+    "Utah 2" before "Utah 10".  Any other zone, even one whose name ends in
+    a number (e.g., "Net 2"), sorts by its name.
+    :param zone_name: A zone name.
+    :param split_parts: The (zone split, part number) of each part of a
+        split zone, keyed by the part's name.
+    :return: The key.
+    """
+    return split_parts.get(zone_name, (zone_name, 0))
 
-def main():
-    parse_args()
-    zones = {}
-    (radio_ids,
-     repeaters,
-     talkgroups,
-     simplex,
-     channel_requests,
-     special_zones,
-     channel_defaults,
-     field_names,
-     lat_long,
-     zone_order) = load_data_from_yaml_files()
-
-    analog_repeaters = get_analog_repeaters_from_repeaterbook(lat_long)
-
-    make_talkgroup_file(talkgroups)
-
-    channels, channels_by_name = make_channels(repeaters,
-                                               talkgroups,
-                                               simplex,
-                                               channel_requests,
-                                               channel_defaults,
-                                               zones,
-                                               radio_ids)
 
-    channels, channels_by_name = \
-        make_analog_repeater_from_repeaterbook_channels(analog_repeaters,
-                                                        channels,
-                                                        channels_by_name,
-                                                        channel_defaults,
-                                                        zones)
+class CodePlugConfig:
+    """
+    Everything a code plug is built from, in memory: the data from the YAML
+    files (in the form the YAML parser gives), the RepeaterBook repeaters,
+    the radio to build for, and the build options.  Nothing is read from
+    disk; see from_data_files() for that.
+    """
+    def __init__(self,
+                 radio_ids,
+                 repeaters,
+                 talkgroups,
+                 simplex,
+                 channel_requests,
+                 special_zones,
+                 channel_defaults,
+                 field_names,
+                 lat_long,
+                 zone_order,
+                 analog_repeaters=(),
+                 target=None,
+                 jobs=1,
+                 duplicates=None,
+                 dup_tolerance_khz=0,
+                 state_zone_size=None,
+                 locations=None):
+        """
+        :param radio_ids: The list of radio ID dicts (radio_ids.yaml)
+        :param repeaters: The dict of repeaters (repeaters*.yaml)
+        :param talkgroups: The dict of talkgroups (talkgroups.yaml)
+        :param simplex: The dict of simplex channels (simplex.yaml)
+        :param channel_requests: The list of channel requests, including the
+            GROUP_ entries (channel_requests*.yaml)
+        :param special_zones: The dict of special zones (special_zones.yaml)
+        :param channel_defaults: The default channel settings
+            (channel_defaults.yaml)
+        :param field_names: The CSV columns for each table (field_names.yaml)
+        :param lat_long: The RepeaterBook regions (lat_long.yaml)
+        :param zone_order: The zones to put first (zone_order.yaml)
+        :param analog_repeaters: The list of repeaters from RepeaterBook, as
+            returned by get_analog_repeaters_from_repeaterbook().
+        :param target: The Target radio.  Default: the first of TARGETS.
+        :param jobs: How many processes to make the channels in
+        :param duplicates: None, or 'report' or 'merge' to look for duplicate
+            channels; see duplicates.py.
+        :param dup_tolerance_khz: How close two channels' frequencies must be
+            to count as duplicates.
+        :param state_zone_size: The most channels to put in a RepeaterBook
+            state zone before splitting it.  Default: the most a zone can
+            hold.
+        :param locations: The repeaters' locations for the zone table, keyed
+            by name, as returned by load_repeater_locations().
+        """
+        self.radio_ids = radio_ids
+        self.repeaters = repeaters
+        self.talkgroups = talkgroups
+        self.simplex = simplex
+        self.channel_requests = channel_requests
+        self.special_zones = special_zones
+        self.channel_defaults = channel_defaults
+        self.field_names = field_names
+        self.lat_long = lat_long
+        self.zone_order = zone_order
+        self.analog_repeaters = list(analog_repeaters)
+        self.locations = locations or {}
+        self.target = target or TARGETS[0]
+        self.jobs = jobs
+        self.duplicates = duplicates
+        self.dup_tolerance_khz = dup_tolerance_khz
+        self.state_zone_size = state_zone_size
+        # What is made from the data the same way for every radio, keyed by
+        # what it is; made the first time a build asks for it, and shared
+        # by the with_target() copies, but no others.  See made().
+        self._made = {}
+
+    @classmethod
+    def from_data_files(cls, data_dir=DATA_DIR, repeaterbook=None,
+                        cache=None, order='longitude', home=None, **options):
+        """
+        Makes a config from the YAML files and RepeaterBook exports.
+        :param data_dir: The directory the YAML files are in.
+        :param repeaterbook: A list of RepeaterBook export paths; see
+            read_repeaterbook_csvs().
+        :param cache: The ParseCache to parse the files through.  Default:
+            no caching.
+        :param order: The name of the order to put each state's
+            RepeaterBook repeaters in; one of ordering.ORDERS.
+        :param home: The home point for the 'distance' order, as (lat, long).
+            Default: the start of the route.
+        :param options: The other CodePlugConfig arguments, e.g., target.
+            Its jobs is also how many RepeaterBook CSV sheets to read at
+            once.
+        :return: A CodePlugConfig
+        """
+        from parse_cache import ParseCache
+        from repeaters_from_repeaterbook import \
+            get_analog_repeaters_from_repeaterbook
+        if cache is None:
+            cache = ParseCache(enabled=False)
+        data = load_data_from_yaml_files(cache, data_dir)
+        repeaters = data[1]
+        lat_long = data[8]
+        analog_repeaters = get_analog_repeaters_from_repeaterbook(
+            lat_long, repeaterbook, cache, make_order(order, lat_long, home),
+            options.get('jobs', 1))
+        locations = load_repeater_locations(cache, repeaters, data_dir)
+        return cls(*data, analog_repeaters=analog_repeaters,
+                   locations=locations, **options)
+
+    def __copy__(self):
+        """
+        :return: A copy of this config sharing its data, but with nothing
+            made from it yet, so the copy's data can be replaced (e.g., by
+            batch.py) without it getting this config's channels.
+        """
+        config = self.__class__.__new__(self.__class__)
+        config.__dict__.update(self.__dict__)
+        config._made = {}
+        return config
+
+    def with_target(self, target):
+        """
+        :param target: A Target radio.
+        :return: A copy of this config, for that radio.  The data is shared,
+            not copied, as are the compiled channel requests and the channels
+            that are the same for every radio.
+        """
+        config = copy.copy(self)
+        config.target = target
+        config._made = self._made
+        return config
+
+    def made(self, name, sources, make):
+        """
+        Something made from the data once, for every radio's build to use.
+        It is made again if any of the data it was made from has been
+        replaced since; data changed in place isn't noticed, so replace it.
+        :param name: What is being made.
+        :param sources: The config's data it is made from, e.g.,
+            (self.channel_requests,).
+        :param make: A function of no arguments that makes it.
+        :return: What make() returned, now or for an earlier call.
+        """
+        try:
+            made_from, thing = self._made[name]
+        except KeyError:
+            pass
+        else:
+            if len(made_from) == len(sources) and \
+                    all(old is new for old, new in zip(made_from, sources)):
+                return thing
+        thing = make()
+        self._made[name] = (sources, thing)
+        return thing
+
+    def compiled_channel_requests(self):
+        """
+        :return: The channel requests, compiled once; see
+            compile_channel_requests().
+        """
+        return self.made('channel_requests', (self.channel_requests,),
+                         lambda: compile_channel_requests(
+                             self.channel_requests))
+
+    def shared_channels(self):
+        """
+        :return: The dict of the analog repeater and simplex channels made
+            so far, for the radios' builds to share; see shared_channel().
+        """
+        return self.made('channels', (self.repeaters, self.simplex,
+                                      self.channel_defaults), dict)
+
+    def repeaterbook_channels(self):
+        """
+        :return: The channels for the RepeaterBook repeaters, made once, in
+            the same order as analog_repeaters.
+        """
+        return self.made('repeaterbook_channels',
+                         (self.analog_repeaters, self.channel_defaults),
+                         lambda: [repeaterbook_channel(repeater,
+                                                       self.channel_defaults)
+                                  for repeater in self.analog_repeaters])
+
+    def location_index(self, split_zones=None):
+        """
+        :param split_zones: The state zones the build split into parts, as
+            returned by split_state_zones().
+        :return: A LocationIndex of the repeaters, for the zone table.
+        """
+        return LocationIndex(self.locations,
+                             ((repeaterbook_zone_name(repeater), repeater)
+                              for repeater in self.analog_repeaters),
+                             split_zones)
+
+
+class CodePlug:
+    """
+    A code plug, as built by build_codeplug().  Its tables are lists of
+    dicts keyed by CSV column name:
+        talkgroups
+        channels
+        radio_ids
+        zones
+    Each table is made the first time it is asked for; the channels and
+    zones are made together.  rows(), csv_text() and write_csv() give them in
+    the form AnyTone CPS imports, and write() writes the CSV files.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.target = config.target
+        self.field_names = dict(config.field_names)
+        self.field_names['talkgroups'] = TALKGROUP_FIELD_NAMES
+        # Each table's columns, worked out once.
+        self.layouts = {name: CsvLayout(self.field_names[name])
+                        for name in TABLES}
+        # The DuplicateFinder, if config.duplicates asked for one, once the
+        # channels are made.
+        self.duplicate_finder = None
+        # The state zones split into parts, keyed by name, each a list of
+        # the parts' names; see split_state_zones().  Made with the zones.
+        self.split_zones = None
+        self._channels = None
+        self._zones = None
+
+    @property
+    def talkgroups(self):
+        return list(talkgroup_dicts(self.config.talkgroups))
+
+    @property
+    def radio_ids(self):
+        return self.config.radio_ids
+
+    @property
+    def channels(self):
+        if self._channels is None:
+            self._make_channels()
+        return self._channels
+
+    @property
+    def zones(self):
+        if self._zones is None:
+            self._make_channels()
+        return self._zones
+
+    @property
+    def zone_table(self):
+        """
+        :return: The lines of zone_table.txt, the zones' numbers, names and
+            locations.
+        """
+        zones = [(zone['Zone Name'], zone['Zone Channel Member'])
+                 for zone in self.zones]
+        return zone_table_lines(zones, self.location_index())
+
+    def location_index(self):
+        """
+        :return: The LocationIndex the zone table is made from.
+        """
+        # The zones are made first, so the split zones are known.
+        self.zones
+        return self.config.location_index(self.split_zones)
+
+    def table(self, name):
+        """
+        :param name: One of TABLES
+        :return: The table, a list of dicts
+        """
+        if name not in TABLES:
+            raise ValueError(f"Unknown table {name}")
+        return getattr(self, name)
+
+    def rows(self, name):
+        """
+        :param name: One of TABLES
+        :return: Yields the table's CSV rows, each a list of values, after
+            the row of column names.
+        """
+        field_names = self.field_names[name]
+        yield list(field_names)
+        yield from csv_rows(self.table(name), field_names)
+
+    def write_csv(self, name, f):
+        """
+        Write a table as CSV to an open file.
+        :param name: One of TABLES
+        :param f: The file, e.g., an io.StringIO, opened with newline=''.
+        :return: None
+        """
+        self.layouts[name].write(self.table(name), f)
+
+    def csv_text(self, name):
+        """
+        :param name: One of TABLES
+        :return: The table as CSV, in a string.
+        """
+        f = io.StringIO(newline='')
+        self.write_csv(name, f)
+        return f.getvalue()
+
+    def write(self, directory=None, tables=TABLES):
+        """
+        Write the CSV files.
+        :param directory: The directory to write them in.  Default: the
+            target radio's.
+        :param tables: Which tables to write.  Default: all of them.
+        :return: None
+        """
+        directory = directory or self.target.directory
+        for name in tables:
+            if name == 'talkgroups':
+                make_talkgroup_file(self.config.talkgroups, directory)
+            else:
+                write_dict_to_csv(self.table(name), name + '.csv',
+                                  self.layouts[name], directory)
+
+    def write_zone_table(self, directory=None):
+        """
+        Write zone_table.txt, and the locations it was made from
+        (zone_locations.json), so that create_zone_table.py can remake it
+        without loading the data files.
+        :param directory: The directory to write them in.  Default: the
+            target radio's.
+        :return: None
+        """
+        directory = directory or self.target.directory
+        write_zone_table(self.zone_table, directory)
+        self.location_index().save(directory)
+
+    def _make_channels(self):
+        config = self.config
+        target = self.target
+        special_zones = config.special_zones
+        zones = {}
+        channels, channels_by_name = make_channels(
+            config.repeaters,
+            config.talkgroups,
+            config.simplex,
+            config.compiled_channel_requests(),
+            config.channel_defaults,
+            zones,
+            config.radio_ids,
+            target,
+            config.jobs,
+            config.shared_channels())
+
+        duplicate_finder = None
+        if config.duplicates:
+            duplicate_finder = DuplicateFinder(config.duplicates,
+                                               config.dup_tolerance_khz)
+            duplicate_finder.check_all(channels)
+        # The channels from the YAML files come first; the RepeaterBook
+        # repeaters get whatever room is left.
+        target_repeaters = prune_repeaterbook_repeaters(
+            config.analog_repeaters, config.lat_long,
+            target.max_channels - len(channels), target)
+        # Their channels are the same for every radio, so are made once and
+        # picked out by repeater; unless analog_repeaters has been changed in
+        # place since, in which case this radio's are made afresh.
+        made_channels = None
+        repeaterbook_channels = config.repeaterbook_channels()
+        if len(repeaterbook_channels) == len(config.analog_repeaters):
+            by_repeater = dict(zip(map(id, config.analog_repeaters),
+                                   repeaterbook_channels))
+            made_channels = [by_repeater[id(repeater)]
+                             for repeater in target_repeaters]
+        channels, channels_by_name = \
+            make_analog_repeater_from_repeaterbook_channels(target_repeaters,
+                                                            channels,
+                                                            channels_by_name,
+                                                            config.channel_defaults,
+                                                            zones,
+                                                            target,
+                                                            duplicate_finder,
+                                                            made_channels)
+        self.duplicate_finder = duplicate_finder
+
+        # Split the big state zones, leaving room for the ALL_ZONES channels.
+        state_repeaters = [(repeaterbook_zone_name(repeater), repeater)
+                           for repeater in target_repeaters]
+        split_zones = split_state_zones(
+            zones,
+            {state for state, _ in state_repeaters},
+            state_repeaters,
+            min(config.state_zone_size or target.max_zone_channels,
+                target.max_zone_channels),
+            len(special_zones['ALL_ZONES']))
+        zone_order = [part for zone_name in config.zone_order
+                      for part in split_zones.get(zone_name, [zone_name])]
+
+        add_special_zone_members(channels_by_name,
+                                 special_zones,
+                                 zones,
+                                 config.radio_ids,
+                                 len(config.radio_ids) == 1)
 
-    add_special_zone_members(channels_by_name,
-                             special_zones,
-                             zones,
-                             radio_ids,
-                             len(radio_ids) == 1)
-    write_dict_to_csv(channels, 'channels.csv', field_names['channels'])
-    write_dict_to_csv(radio_ids, 'radio_ids.csv', field_names['radio_ids'])
-    zone_list = change_zone_dict_to_list(zones, zone_order)
-    write_dict_to_csv(zone_list, 'zones.csv', field_names['zones'])
+        # Make sure it all fits in the radio.
+        common_names = {channels_by_name[str(chan)]['Channel Name']
+                        for chan in special_zones['ALL_ZONES']}
+        zone_names = zone_names_in_order(zones, zone_order, split_zones)
+        zone_names = fit_channels(channels, channels_by_name, zones,
+                                  zone_names, target)
+        zone_names = fit_zones(zones, zone_names, target, common_names)
+
+        self.split_zones = split_zones
+        self._channels = channels
+        self._zones = list(change_zone_dict_to_list(zones, zone_names))
+
+
+def build_codeplug(config):
+    """
+    Builds a code plug in memory.  Nothing is read from or written to disk.
+    :param config: A CodePlugConfig
+    :return: A CodePlug.  Its tables are made as they are asked for.
+    """
+    return CodePlug(config)
+
+
+def stage_digests(config):
+    """
+    Digests of the data each stage of the build is made from, for incremental
+    builds.
+    :param config: The CodePlugConfig
+    :return: A dict of digests, keyed by stage name
+    """
+    return {
+        'talkgroups': data_digest(OUTPUT_FORMAT, config.talkgroups),
+        'radio_ids': data_digest(OUTPUT_FORMAT, config.radio_ids,
+                                 config.field_names['radio_ids']),
+        'channels': data_digest(OUTPUT_FORMAT, config.radio_ids,
+                                config.repeaters, config.talkgroups,
+                                config.simplex, config.channel_requests,
+                                config.special_zones, config.channel_defaults,
+                                config.field_names, config.zone_order,
+                                config.analog_repeaters),
+        'zone_table': data_digest(OUTPUT_FORMAT, config.locations)
+    }
+
+
+def build_target(config, build_state, digests):
+    """
+    Builds and writes the code plug for one radio.
+    :param config: The CodePlugConfig, for the radio
+    :param build_state: The BuildState for the radio's directory
+    :param digests: The stage digests from stage_digests()
+    :return: The build_state, updated with the stages that were built.
+    """
+    target = config.target
+    codeplug = build_codeplug(config)
+
+    # Each stage is rebuilt only if the data it is made from has changed.
+    channels_digest = data_digest(digests['channels'], target.name,
+                                  config.duplicates, config.dup_tolerance_khz,
+                                  config.state_zone_size)
+    # The zone table is made from the zones, so it changes when they do.
+    zone_table_digest = data_digest(channels_digest, digests['zone_table'])
+    stages = [('talkgroups', digests['talkgroups'], ['talkgroups']),
+              ('channels', channels_digest, ['channels', 'zones']),
+              ('radio_ids', digests['radio_ids'], ['radio_ids']),
+              ('zone_table', zone_table_digest, [])]
+    for stage, digest, tables in stages:
+        outputs = [table + '.csv' for table in tables]
+        if stage == 'zone_table':
+            outputs = [ZONE_TABLE_FILE, LOCATIONS_FILE]
+        if build_state.is_current(stage, digest, outputs):
+            continue
+        if stage == 'channels':
+            # Make them before writing either file, for the messages.
+            codeplug.channels
+            if codeplug.duplicate_finder is not None:
+                codeplug.duplicate_finder.report(target.name)
+        if stage == 'zone_table':
+            codeplug.write_zone_table(target.directory)
+        else:
+            codeplug.write(target.directory, tables)
+        build_state.built(stage, digest, outputs)
+    return build_state
+
+
+def main(argv=None, prog=None):
+    parse_args(argv, prog)
+    if args.watch:
+        watch_and_build()
+        return
+    with timing.instrument(args.timings, args.profile):
+        if args.check:
+            check()
+        else:
+            build()
+
+
+def watch_and_build():
+    """
+    Builds the code plugs, and zone tables, then rebuilds them whenever the
+    input files change, until interrupted.  The builds are incremental, so
+    only the outputs whose data changed are rewritten, and the parsed files
+    are kept in memory between builds.
+    :return: None
+    """
+    # Imported here, as they're only needed for --watch.
+    from parse_cache import ParseCache
+    from watch import changes, make_watcher
+    args.incremental = True
+    cache = ParseCache(enabled=not args.no_cache)
+    directories = {os.path.dirname(path) or '.' for path in input_files()}
+    directories |= {path for path in args.repeaterbook or []
+                    if os.path.isdir(path)}
+    directories.add('data_files')
+    watcher = make_watcher(sorted(directories))
+    print(f"Watching {', '.join(sorted(directories))} "
+          f"({type(watcher).__name__}). Ctrl-C to stop.")
+
+    def rebuild():
+        start = time.perf_counter()
+        with timing.instrument(args.timings):
+            if args.check:
+                check(cache)
+            else:
+                build(cache)
+        done = 'Checked' if args.check else 'Built'
+        print(f"{done} in {time.perf_counter() - start:.2f} seconds.")
+
+    try:
+        rebuild()
+        for changed in changes(watcher):
+            print(f"Changed: {', '.join(sorted(changed))}")
+            try:
+                rebuild()
+            except Exception as e:
+                # Most likely a mistake in the file being edited.  Keep
+                # watching, so the fix gets built.
+                print(f"Build failed: {e!r}")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+def selected_targets():
+    """
+    :return: The Targets selected on the command line.
+    """
+    return [target for target in TARGETS if getattr(args, target.name)]
+
+
+def config_from_args(cache=None):
+    """
+    Loads the data files, with the options given on the command line.
+    :param cache: The ParseCache to parse the input files through.  By
+        default, a new one.
+    :return: A CodePlugConfig, with no target.
+    """
+    from parse_cache import ParseCache
+    if cache is None:
+        cache = ParseCache(enabled=not args.no_cache)
+    return CodePlugConfig.from_data_files(
+        DATA_DIR, args.repeaterbook, cache,
+        order=args.order,
+        home=args.home,
+        jobs=args.jobs,
+        duplicates=args.duplicates,
+        dup_tolerance_khz=args.dup_tolerance_khz,
+        state_zone_size=args.state_zone_size)
+
+
+def output_options():
+    """
+    :return: The command line options that change what is built, keyed by
+        name.  They are part of the incremental builds' inputs digest, so
+        changing one rebuilds the outputs it affects even if no input file
+        has changed.
+    """
+    return {
+        'repeaterbook': args.repeaterbook,
+        'duplicates': args.duplicates,
+        'dup_tolerance_khz': args.dup_tolerance_khz,
+        'state_zone_size': args.state_zone_size,
+        'order': args.order,
+        'home': args.home,
+    }
+
+
+def check(cache=None):
+    """
+    Builds the code plugs for the radios selected on the command line in
+    memory, for --check, and reports what they would hold.  The messages
+    about missing channels, duplicates and what didn't fit are printed as in
+    a build.  Each table is turned into CSV, in memory, so anything that
+    would stop the files being written is found too; nothing is written.
+    :param cache: The ParseCache to parse the input files through.  By
+        default, a new one.
+    :return: None
+    """
+    config = config_from_args(cache)
+    for target in selected_targets():
+        codeplug = build_codeplug(config.with_target(target))
+        for name in TABLES:
+            codeplug.write_csv(name, io.StringIO(newline=''))
+        codeplug.zone_table
+        if codeplug.duplicate_finder is not None:
+            codeplug.duplicate_finder.report(target.name)
+        print(f"{target.name}: {len(codeplug.talkgroups)} talkgroups, "
+              f"{len(codeplug.channels)} of {target.max_channels} channels, "
+              f"{len(codeplug.zones)} of {target.max_zones} zones, "
+              f"{len(codeplug.radio_ids)} radio IDs. Nothing written.")
+
+
+def build(cache=None):
+    """
+    Builds the code plugs for the radios selected on the command line.
+    :param cache: The ParseCache to parse the input files through.  By
+        default, a new one.
+    :return: None
+    """
+    targets = selected_targets()
+    build_states = [BuildState(target.directory, args.incremental)
+                    for target in targets]
+
+    # If none of the input files, or the options, or the code's
+    # OUTPUT_FORMAT, have changed, there's nothing to do.
+    if args.incremental:
+        inputs_digest = data_digest(OUTPUT_FORMAT,
+                                    file_digest(input_files()),
+                                    output_options())
+        if all(build_state.is_current('inputs', inputs_digest, ALL_OUTPUTS)
+               for build_state in build_states):
+            print("Nothing to rebuild, the inputs and options haven't "
+                  "changed.")
+            return
+
+    # The data files are loaded once, however many radios we're building for.
+    config = config_from_args(cache)
+    digests = stage_digests(config)
+    configs = [config.with_target(target) for target in targets]
+
+    if args.parallel and len(targets) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(len(targets)) as executor:
+            build_states = list(executor.map(build_target,
+                                             configs,
+                                             build_states,
+                                             repeat(digests)))
+    else:
+        build_states = [build_target(config, build_state, digests)
+                        for config, build_state in zip(configs, build_states)]
+
+    if args.incremental:
+        for target, build_state in zip(targets, build_states):
+            build_state.built('inputs', inputs_digest)
+            build_state.save()
+            if build_state.rebuilt:
+                print(f"{target.name}: Rebuilt " +
+                      ', '.join(build_state.rebuilt))
+            else:
+                print(f"{target.name}: Nothing to rebuild, the inputs' data "
+                      "hasn't changed.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+"""
+capacity.py
+Making the code plug fit in the radio.  The radios hold a limited number of
+channels and zones, and of channels in each zone (see Target in builder.py).
+The CPS refuses, or quietly truncates, CSV files with more than that, so the
+build trims the code plug to fit, printing what it left out:
+
+    - The channels from the YAML files come first.  If there isn't room for
+      all the RepeaterBook repeaters as well, the ones furthest from the
+      middle of their lat_long.yaml region (or from the path of a corridor)
+      are left out.
+    - A RepeaterBook state zone that is too big (or bigger than
+      --state-zone-size) is split into geographically compact parts,
+      "Utah 1", "Utah 2", and so on, by cutting its repeaters, in the order
+      they fall along a Hilbert curve, into equal pieces.
+    - A zone with too many channels is split into parts, "Utah 1",
+      "Utah 2", and so on.  The ALL_ZONES channels go in every part.
+    - If there are too many zones, the last ones in zones.csv order are
+      left out.
+    - If the YAML files alone have too many channels, the last ones made
+      are left out, and taken out of their zones.
+"""
+from regions import RegionIndex, hilbert_index
+from timing import timed
+
+# How many of the channels or zones left out to name in the messages.
+NAMES_SHOWN = 20
+
+
+@timed
+def prune_repeaterbook_repeaters(repeaters, lat_long, room, target):
+    """
+    Choose the RepeaterBook repeaters to make channels for, when there isn't
+    room for them all.
+    :param repeaters: The list of repeaters from RepeaterBook, each with its
+        Lat and Long.
+    :param lat_long: The lat/long regions the repeaters were selected from.
+    :param room: How many more channels the radio can hold.
+    :param target: The Target radio.
+    :return: The repeaters to keep, in their original order.  Repeaters on
+        bands the radio doesn't have are dropped either way.
+    """
+    repeaters = [repeater for repeater in repeaters
+                 if not target.skips(repeater)]
+    room = max(room, 0)
+    if len(repeaters) <= room:
+        return repeaters
+    region_index = RegionIndex(lat_long)
+    distances = [region_index.distance(repeater['Lat'], repeater['Long'])
+                 for repeater in repeaters]
+    # Sort the positions by distance, ties in the original order, and keep
+    # the nearest in their original order so the zones come out the same.
+    nearest = sorted(range(len(repeaters)), key=distances.__getitem__)[:room]
+    if nearest:
+        print(f"{target.name}: Room for {room} of the {len(repeaters)} "
+              f"RepeaterBook repeaters; keeping those within "
+              f"{distances[nearest[-1]]:.1f} miles of the middle of their "
+              f"region.")
+    else:
+        print(f"{target.name}: No room for the {len(repeaters)} RepeaterBook "
+              f"repeaters.")
+    return [repeaters[i] for i in sorted(nearest)]
+
+
+@timed
+def split_state_zones(zones, state_names, repeaters, max_channels,
+                      common_count=0):
+    """
+    Split the state zones made from the RepeaterBook repeaters into
+    geographically compact parts.  This is done before the ALL_ZONES
+    channels are added, and leaves room for them.
+    :param zones: A dict of Zones, keyed by name; updated in place.
+    :param state_names: The names of the zones the RepeaterBook channels
+        went into.  They may hold other channels too (e.g., Ana Rptrs);
+        those have no location, and come first.
+    :param repeaters: The RepeaterBook repeaters the channels were made
+        from, as (state zone name, repeater) pairs, each repeater with its
+        Lat and Long.  Town names repeat across states, so a repeater is
+        only located in its own state's zone.
+    :param max_channels: The most channels a state zone may end up with.
+    :param common_count: How many channels (ALL_ZONES) will be added to
+        every zone.
+    :return: A dict of the zones split, keyed by the old name, each a list
+        of the new names.
+    """
+    # (lat, long), keyed by (state zone name, channel name).
+    locations = {}
+    for state, repeater in repeaters:
+        locations.setdefault((state, repeater['Name']), (repeater['Lat'],
+                                                         repeater['Long']))
+    chunk_size = max(max_channels - common_count, 1)
+    split = {}
+    for zone_name in sorted(state_names):
+        zone = zones[zone_name]
+        if len(zone) <= chunk_size:
+            continue
+        located = [locations[(zone_name, name)] for name in zone.members
+                   if (zone_name, name) in locations]
+        if not located:
+            continue
+        lats = [lat for lat, _ in located]
+        longs = [long for _, long in located]
+        bounds = (min(lats), max(lats), min(longs), max(longs))
+
+        def curve_position(name):
+            if (zone_name, name) not in locations:
+                return -1
+            return hilbert_index(*locations[(zone_name, name)], bounds)
+
+        # Each part's channels stay in the zone's order (see ordering.py).
+        ordered = sorted(zone.members, key=curve_position)
+        del zones[zone_name]
+        split[zone_name] = []
+        for start in range(0, len(ordered), chunk_size):
+            part_name = f"{zone_name} {len(split[zone_name]) + 1}"
+            zones[part_name] = zone.subset(
+                part_name, set(ordered[start:start + chunk_size]))
+            split[zone_name].append(part_name)
+    return split
+
+
+@timed
+def fit_channels(channels, channels_by_name, zones, zone_names, target):
+    """
+    Leave out the channels beyond the radio's limit, taking them out of
+    their zones.  Zones left empty are left out too.
+    :param channels: The list of channels; shortened in place.
+    :param channels_by_name: The channels_by_name dict; updated to match.
+    :param zones: A dict of Zones, keyed by name; updated to match.
+    :param zone_names: The zone names, in zones.csv order.
+    :param target: The Target radio.
+    :return: The zone names that are left, in zones.csv order.
+    """
+    if len(channels) <= target.max_channels:
+        return zone_names
+    left_out = channels[target.max_channels:]
+    del channels[target.max_channels:]
+    left_out_names = [channel['Channel Name'] for channel in left_out]
+    print(f"{target.name}: Too many channels; leaving out the last "
+          f"{len(left_out)}: {name_list(left_out_names)}")
+    left_out_names = set(left_out_names)
+    for name in left_out_names:
+        del channels_by_name[name]
+    kept_zone_names = []
+    for zone_name in zone_names:
+        zone = zones[zone_name]
+        zone.discard(left_out_names)
+        if len(zone):
+            kept_zone_names.append(zone_name)
+        else:
+            del zones[zone_name]
+    return kept_zone_names
+
+
+@timed
+def fit_zones(zones, zone_names, target, common_names=()):
+    """
+    Split the zones with too many channels, and leave out the zones beyond
+    the radio's limit.
+    :param zones: A dict of Zones, keyed by name; updated in place.
+    :param zone_names: The zone names, in zones.csv order.
+    :param target: The Target radio.
+    :param common_names: The names of the channels that go in every zone
+        (ALL_ZONES in special_zones.yaml).  They go in every part of a split
+        zone.
+    :return: The zone names to write, in zones.csv order.
+    """
+    fitted_names = []
+    for zone_name in zone_names:
+        zone = zones[zone_name]
+        if len(zone) <= target.max_zone_channels:
+            fitted_names.append(zone_name)
+            continue
+        del zones[zone_name]
+        parts = split_zone(zone, target.max_zone_channels, common_names)
+        print(f"{target.name}: Zone {zone_name} has {len(zone)} channels; "
+              f"split into {len(parts)} zones.")
+        for part in parts:
+            zones[part.name] = part
+            fitted_names.append(part.name)
+
+    if len(fitted_names) > target.max_zones:
+        left_out = fitted_names[target.max_zones:]
+        del fitted_names[target.max_zones:]
+        print(f"{target.name}: Too many zones; leaving out the last "
+              f"{len(left_out)}: {name_list(left_out)}")
+        for zone_name in left_out:
+            del zones[zone_name]
+    return fitted_names
+
+
+def split_zone(zone, max_channels, common_names=()):
+    """
+    Split a zone into parts of at most max_channels channels each.
+    :param zone: A Zone.
+    :param max_channels: The most channels a zone may have.
+    :param common_names: The names of channels that go in every part.
+    :return: A list of Zones, named "<zone name> 1", "<zone name> 2", etc.
+        Each has its share of the zone's channels, plus the common ones, in
+        the order they were in the zone.
+    """
+    common = {name for name in zone.members if name in common_names}
+    others = [name for name in zone.members if name not in common]
+    chunk_size = max(max_channels - len(common), 1)
+    parts = []
+    for start in range(0, len(others), chunk_size):
+        chunk = set(others[start:start + chunk_size]) | common
+        parts.append(zone.subset(f"{zone.name} {len(parts) + 1}", chunk))
+    return parts
+
+
+def name_list(names):
+    """
+    :param names: Some channel or zone names.
+    :return: The first NAMES_SHOWN of them, comma separated, for a message.
+    """
+    names = list(names)
+    text = ', '.join(names[:NAMES_SHOWN])
+    if len(names) > NAMES_SHOWN:
+        text += f", and {len(names) - NAMES_SHOWN} more"
+    return text
@@ -0,0 +1,76 @@
+"""
+cli.py
+One command for the code plug tools:
+
+    python cli.py build --AT578            Build the code plug (builder.py)
+    python cli.py build --AT578 --check    Dry run; nothing is written
+    python cli.py zone-table --AT578       Remake zone_table.txt
+    python cli.py batch members --AT578    Build many members' code plugs
+    python cli.py csv-to-yaml -c x.csv     Convert a CPS CSV export to YAML
+    python cli.py store-repeaterbook       Convert the RepeaterBook exports
+    python cli.py benchmark                Time the build
+
+The scripts can still be run on their own, with the same options.
+
+Only the module for the command given is imported, and the modules import
+what only some of their options need (the YAML parser, process pools, file
+watching, profiling) when those options are used.  So quick commands, like
+--help or remaking the zone table, don't pay for loading the build.  The
+startup time is measured by benchmark.py --startup, against
+STARTUP_TARGET_SECONDS.
+"""
+import importlib
+import sys
+
+# The subcommands: the module whose main() runs each, and what it does.
+COMMANDS = {
+    'build': ('builder', "Build the code plug CSV files"),
+    'zone-table': ('create_zone_table',
+                   "Remake zone_table.txt from the last build"),
+    'batch': ('batch', "Build many members' code plugs at once"),
+    'csv-to-yaml': ('csv_to_yaml', "Convert a CPS CSV export to YAML"),
+    'store-repeaterbook': ('repeater_store',
+                           "Convert the RepeaterBook exports to a columnar "
+                           "store"),
+    'benchmark': ('benchmark', "Time the build against synthetic data"),
+}
+
+# How long starting a command (its --help) may add to the Python
+# interpreter's own startup; see benchmark.py --startup.
+STARTUP_TARGET_SECONDS = 0.1
+
+
+def usage():
+    """
+    :return: The usage message, listing the commands.
+    """
+    lines = ["usage: cli.py COMMAND [OPTIONS]", "", "commands:"]
+    for command, (_, description) in COMMANDS.items():
+        lines.append(f"  {command:20}{description}")
+    lines.append("")
+    lines.append("Give a command --help to see its options.")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Runs the command named by the first argument, with the rest.  argparse
+    isn't used here, so that it only has to be imported by the command.
+    :param argv: The arguments.  Default: the command line's.
+    :return: None
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return
+    command = argv[0]
+    if command not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        sys.exit(f"cli.py: unknown command {command}")
+    module_name, _ = COMMANDS[command]
+    module = importlib.import_module(module_name)
+    module.main(argv[1:], prog=f"cli.py {command}")
+
+
+if __name__ == '__main__':
+    main()
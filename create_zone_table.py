@@ -2,93 +2,279 @@
 As of this writing we have 81 zones. That's a lot to scroll through.
 Fortunately, the 578 allows you to enter the zone number. So we build
 a cheat sheet, showing the number, zone name on screen, and location.
-The zone number and name are taken from the zones.csv file. The
-repeater_xxx.yaml files have the name and location.
+
+builder.py writes the cheat sheet, zone_table.txt, along with the CSV files,
+from the zones it has just made, so the two always agree.  This script
+remakes it from the zones.csv already written, and the locations the build
+saved alongside it in zone_locations.json; so it needn't load the data
+files, and the locations are those of the RepeaterBook repeaters the build
+used.
+
+The locations come from a LocationIndex, keyed by channel name:
+    - A repeater in the repeaters_xxx.yaml files is located by the comment
+      above it, e.g., "# Butte, MT".  YAML parsers throw comments away, so
+      the files' comments are read separately (and cached), by top level
+      key, and matched up with the parsed repeaters.
+    - A RepeaterBook state zone too big for the radio is split by builder.py
+      into parts covering smaller areas, "Utah 1", "Utah 2", etc.  Their
+      location is the towns of their first and last repeaters, in the order
+      the build put them in (builder.py --order), from the RepeaterBook
+      records.
 """
 import argparse
 import csv
-from glob import glob
+import json
 import os
+import re
+import sys
+
+import timing
+from timing import timed
+
+# The cheat sheet, written in each radio's directory.
+ZONE_TABLE_FILE = 'zone_table.txt'
+
+# The locations the cheat sheet is made from, saved by the build next to
+# zones.csv; see LocationIndex.save().
+LOCATIONS_FILE = 'zone_locations.json'
+
+# A top level key in a YAML file, e.g., "Butte:", perhaps with a comment.
+TOP_LEVEL_KEY = re.compile(r'([^\s#][^:]*):\s*(#.*)?$')
 
 args = 0
 
 
-def parse_args():
+def parse_args(argv=None, prog=None):
+    """
+    :param argv: The arguments to parse.  Default: the command line's.
+    :param prog: The program name for the usage message, e.g., when run as
+        a cli.py subcommand.
+    :return: None.  The global args is set.
+    """
     global args
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Remake zone_table.txt, a numbered list of "
+                               "the zones and where they are, from "
+                               "zones.csv.")
     parser.add_argument('--AT878', action='store_true',
                         help="Omit any 220 frequencies, save files in ../878")
     parser.add_argument('--AT578', action='store_true',
                         help="Include any 220 frequencies, save files in ../578")
-    args = parser.parse_args()
+    parser.add_argument('--timings', action='store_true',
+                        help="Report the wall time, call count and memory "
+                             "allocated for each stage")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Profile with cProfile, and write the stats to "
+                             "FILE")
+    args = parser.parse_args(argv)
     if args.AT578 and args.AT878:
         parser.error("AT578 and AT878 are mutually exclusive")
     if not (args.AT578 or args.AT878):
         parser.error("One of AT578 or AT878 must be supplied")
 
 
-def create_name_to_location_dict():
-    location_dict = {}
-    for repeater_file in glob('data_files/repeaters_*.yaml'):
-        with open(repeater_file) as f:
-            have_location = False
-            location = ''
-            while True:
-                line = f.readline()
-                if not line:
-                    break
-                if line.startswith('#'):
-                    location = line.split('#')[1].strip()
-                    have_location = True
-                    continue
-                if 'Name:' in line:
-                    if not have_location:
-                        continue
-                    name = line.split(':')[1].strip()
-                    location_dict[name] = location
-                    # We've used this location
-                    have_location = False
-    return location_dict
-
-
-def read_zones_file():
-    if args.AT578:
-        path = '../578'
-    else:
-        path = '../878'
+def comment_locations(path):
+    """
+    Reads the location comments in a repeaters_xxx.yaml file.  A comment
+    line is the location of the repeater whose key comes next, e.g.,
+
+        # Butte, MT
+        Butte:
+          Name: Butte
+
+    :param path: The file.
+    :return: A dict of the locations, keyed by the repeaters' keys.
+    """
+    locations = {}
+    location = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                location = line[1:].strip()
+                continue
+            match = TOP_LEVEL_KEY.match(line.rstrip('\n'))
+            if match:
+                if location is not None:
+                    locations[match.group(1).strip()] = location
+                # We've used this location
+                location = None
+    return locations
+
+
+@timed
+def repeater_locations(repeaters, comments):
+    """
+    :param repeaters: The repeaters dict from the repeaters_xxx.yaml files.
+    :param comments: The location comments from those files, keyed by
+        repeater key; see comment_locations().
+    :return: A dict of the locations, keyed by repeater (and so channel and
+        zone) name.
+    """
+    return {repeater['Name']: comments[str(key)]
+            for key, repeater in repeaters.items() if str(key) in comments}
 
+
+class LocationIndex:
+    """
+    Where the zones are, for the zone table.  A zone named after a repeater
+    is located by the repeater's comment.  A part of a split state zone is
+    located by the RepeaterBook repeaters in it.
+    """
+    def __init__(self, locations, state_repeaters=(), split_zones=None):
+        """
+        :param locations: The repeaters' locations, keyed by name; see
+            repeater_locations().
+        :param state_repeaters: The RepeaterBook repeaters, as (state zone
+            name, repeater) pairs.  Each repeater is named "<town> - <site>".
+        :param split_zones: The state zones builder.py split into parts, as
+            returned by capacity.split_state_zones(): a list of the parts'
+            names, keyed by the state zone's name.
+        """
+        self.locations = locations
+        # Towns, keyed by (state zone name, channel name).  The same town
+        # name turns up in more than one state.
+        self.towns = {}
+        for state, repeater in state_repeaters:
+            self.towns.setdefault((state, repeater['Name']),
+                                  repeater['Name'].split(' - ')[0])
+        # The state zone each part of a split zone came from, keyed by the
+        # part's name.  Other zones whose names end in a number, e.g.,
+        # "Net 2", aren't parts.
+        self.parts = {part: state
+                      for state, parts in (split_zones or {}).items()
+                      for part in parts}
+
+    def save(self, path):
+        """
+        Writes the index to LOCATIONS_FILE, for load().
+        :param path: The directory to write it in, e.g., ../578.
+        :return: None
+        """
+        data = {
+            'locations': self.locations,
+            'towns': [[state, name, town]
+                      for (state, name), town in self.towns.items()],
+            'parts': self.parts,
+        }
+        with open(os.path.join(path, LOCATIONS_FILE), 'w') as f:
+            json.dump(data, f, indent=0)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: The directory save() wrote LOCATIONS_FILE in.
+        :return: The LocationIndex.
+        """
+        with open(os.path.join(path, LOCATIONS_FILE)) as f:
+            data = json.load(f)
+        index = cls(data['locations'])
+        index.towns = {(state, name): town
+                       for state, name, town in data['towns']}
+        index.parts = data['parts']
+        return index
+
+    def zone_location(self, zone, members, common_members=()):
+        """
+        :param zone: A zone name.
+        :param members: The zone's channel names.
+        :param common_members: The channels that are in every zone.
+        :return: The zone's location, or "" if it isn't known.
+        """
+        try:
+            return self.locations[zone]
+        except KeyError:
+            return self.split_zone_location(zone, members, common_members)
+
+    def split_zone_location(self, zone, members, common_members=()):
+        """
+        :param zone: A zone name.
+        :param members: The zone's channel names.
+        :param common_members: The channels that are in every zone.
+        :return: A location for a part of a split state zone, e.g.
+            "Utah: Ogden to Provo", from its first and last repeaters, or ""
+            if the zone isn't one.
+        """
+        try:
+            state = self.parts[zone]
+        except KeyError:
+            return ""
+        # The members are in the order the build put the repeaters in.
+        towns = [self.towns[(state, member)] for member in members
+                 if (state, member) in self.towns and
+                 member not in common_members]
+        if not towns:
+            return ""
+        first = towns[0]
+        last = towns[-1]
+        if first == last:
+            return f"{state}: {first}"
+        return f"{state}: {first} to {last}"
+
+
+@timed
+def zone_table_lines(zones, location_index):
+    """
+    :param zones: A list of (zone name, member channel names), in zones.csv
+        order.
+    :param location_index: A LocationIndex.
+    :return: The lines of zone_table.txt: the zone number, name and location,
+        tab separated.
+    """
+    common_members = set.intersection(*[set(members)
+                                         for _, members in zones]) \
+        if zones else set()
+    return [f"{zone_num}\t{zone}\t"
+            f"{location_index.zone_location(zone, members, common_members)}"
+            for zone_num, (zone, members) in enumerate(zones, 1)]
+
+
+def write_zone_table(lines, path):
+    """
+    :param lines: The lines from zone_table_lines().
+    :param path: The directory to write zone_table.txt in, e.g., ../578.
+    :return: None
+    """
+    with open(os.path.join(path, ZONE_TABLE_FILE), 'w') as f:
+        for line in lines:
+            print(line, file=f)
+
+
+@timed
+def read_zones_file(path):
     with open(os.path.join(path, 'zones.csv')) as f:
         # Get rid of the header row.
         f.readline()
         reader = csv.reader(f)
         # We will be appending the zone names, so zone 1 is at index 0.
+        # Each zone's members are kept, for locating split state zones.
         zones = []
         for line in reader:
-            zones.append(line[1])
+            zones.append((line[1], line[2].split('|')))
     return zones
 
 
-def merge_and_print_information(zones, location_dict):
+def make_zone_table(path):
+    """
+    Write zone_table.txt from the zones.csv and zone_locations.json in a
+    directory.
+    :param path: The directory, e.g., ../578.
+    :return: None
+    """
+    if not os.path.exists(os.path.join(path, LOCATIONS_FILE)):
+        sys.exit(f"There is no {LOCATIONS_FILE} in {path}. Run builder.py "
+                 f"to write it.")
+    zones = read_zones_file(path)
+    write_zone_table(zone_table_lines(zones, LocationIndex.load(path)), path)
+
+
+def main(argv=None, prog=None):
+    parse_args(argv, prog)
     if args.AT578:
         path = '../578'
     else:
         path = '../878'
-
-    with open(os.path.join(path, 'zone_table.txt'), 'w') as f:
-        for i, zone in enumerate(zones):
-            zone_num = i + 1
-            try:
-                location = location_dict[zone]
-            except KeyError:
-                location = ""
-            print(f"{zone_num}\t{zone}\t{location}", file=f)
-
-
-def main():
-    parse_args()
-    location_dict = create_name_to_location_dict()
-    zones = read_zones_file()
-    merge_and_print_information(zones, location_dict)
+    with timing.instrument(args.timings, args.profile):
+        make_zone_table(path)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,16 @@
 import argparse
 import csv
-import yaml
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Convert a CSV file exported from the CPS to "
+                               "YAML.")
     parser.add_argument('-c', '--csv-file', default='channels.csv',
                         help="The CSV file to convert to YAML")
     parser.add_argument('-y', '--yaml-file', default='generated_channels.yaml',
                         help="The YAML file to write")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 
@@ -28,12 +29,14 @@ def csv_to_dict_list(csv_file):
 
 
 def dict_list_to_yaml(dict_list, yaml_file):
+    # Imported here, so --help doesn't wait for it.
+    import yaml
     with open(yaml_file, 'w') as f:
         print(yaml.dump(dict_list), file=f)
 
 
-def main():
-    args = parse_args()
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
     d = csv_to_dict_list(args.csv_file)
     dict_list_to_yaml(d, args.yaml_file)
 
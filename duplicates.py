@@ -0,0 +1,215 @@
+"""
+duplicates.py
+Finding analog channels that duplicate each other.  The same repeater can
+turn up in repeaters_*.yaml, simplex.yaml and the RepeaterBook export under
+different names, and each copy takes up one of the radio's limited channel
+slots.
+
+Two analog channels are duplicates if they have the same transmit tone, and
+their receive and transmit frequencies are each within a tolerance of the
+other's (by default, exactly the same).  Digital channels are not checked;
+many of them share a frequency by design, one per talkgroup.
+
+The same frequencies and tone are also used by many different repeaters,
+hundreds of miles apart.  So a duplicate is only merged (left out, see
+DuplicateFinder) if it is the same site as the channel it duplicates: both
+from RepeaterBook, which gives their positions, in the same state and
+within SAME_SITE_MILES of each other.  The channels from the YAML files
+have no position, so their duplicates are only ever reported.
+
+The channels seen so far are kept in a FrequencyIndex, a dict of buckets
+keyed by the rounded frequencies and the tone, so each channel is only
+compared with the few channels in the buckets around it.
+"""
+import sys
+
+from regions import point_distance
+
+# What to do about duplicates: just report them, or also leave the
+# RepeaterBook copies out of the code plug.
+DUPLICATE_MODES = ['report', 'merge']
+
+# How far apart, in miles, two listings of a repeater may be placed and
+# still be taken for the same site.  RepeaterBook's positions are often
+# only the nearest town's.
+SAME_SITE_MILES = 10
+
+
+def frequency_hz(frequency):
+    """
+    :param frequency: A frequency in MHz, as a number or a string.
+    :return: The frequency in Hz, as an int.
+    """
+    return round(float(frequency) * 1000000)
+
+
+def site_distance(site, other_site):
+    """
+    :param site: A channel's site, as (state, lat, long), or None if not
+        known.
+    :param other_site: Another channel's site, likewise.
+    :return: The miles between them, or None if either isn't known.
+    """
+    if site is None or other_site is None:
+        return None
+    return point_distance(site[1], site[2], other_site[1], other_site[2])
+
+
+def same_site(site, other_site):
+    """
+    :param site: A channel's site, as (state, lat, long), or None.
+    :param other_site: Another channel's site, likewise.
+    :return: True if both are known, and are in the same state within
+        SAME_SITE_MILES of each other.
+    """
+    distance = site_distance(site, other_site)
+    return distance is not None and site[0] == other_site[0] and \
+        distance <= SAME_SITE_MILES
+
+
+def tone_key(tone):
+    """
+    :param tone: A CTCSS tone, as a number or a string, or 'Off'.  DCS codes
+        are left as they are.
+    :return: The tone in a form that compares equal however it was written,
+        e.g., 100, '100' and '100.0'.
+    """
+    try:
+        return round(float(tone), 1)
+    except (TypeError, ValueError):
+        return str(tone)
+
+
+class FrequencyIndex:
+    """
+    The channels added so far, in buckets keyed by receive frequency,
+    transmit frequency and transmit tone.  The buckets are as wide as the
+    tolerance, so any channel within the tolerance of a given one is in the
+    same bucket or a neighboring one.
+    """
+    def __init__(self, tolerance_khz=0):
+        self.tolerance = round(tolerance_khz * 1000)
+        self.bucket_width = max(self.tolerance, 1)
+        self.buckets = {}
+
+    def _key(self, channel):
+        rx = frequency_hz(channel['Receive Frequency'])
+        tx = frequency_hz(channel['Transmit Frequency'])
+        tone = tone_key(channel['CTCSS/DCS Encode'])
+        return rx, tx, tone
+
+    def add(self, channel, site=None):
+        """
+        :param channel: A channel dict.
+        :param site: Where it is, as (state, lat, long), or None.
+        """
+        rx, tx, tone = self._key(channel)
+        bucket = (rx // self.bucket_width, tx // self.bucket_width, tone)
+        self.buckets.setdefault(bucket, []).append((rx, tx, channel, site))
+
+    def matches(self, channel):
+        """
+        :param channel: A channel dict.
+        :return: Yields (channel, site) for each channel added that the
+            channel duplicates.
+        """
+        rx, tx, tone = self._key(channel)
+        rx_bucket = rx // self.bucket_width
+        tx_bucket = tx // self.bucket_width
+        offsets = (-1, 0, 1) if self.tolerance else (0,)
+        for rx_offset in offsets:
+            for tx_offset in offsets:
+                bucket = self.buckets.get((rx_bucket + rx_offset,
+                                           tx_bucket + tx_offset,
+                                           tone))
+                if bucket is None:
+                    continue
+                for other_rx, other_tx, other, other_site in bucket:
+                    if abs(other_rx - rx) <= self.tolerance and \
+                            abs(other_tx - tx) <= self.tolerance:
+                        yield other, other_site
+
+
+class DuplicateFinder:
+    """
+    Checks each analog channel as it is made against those made before it,
+    and records the duplicates found.  In 'merge' mode, duplicates that may
+    be merged (the RepeaterBook ones) are left out by the caller, who uses
+    the earlier channel in their place, if the two are the same site.
+    Duplicates among the channels from the YAML files are only reported,
+    since special_zones.yaml may refer to them by name.
+    """
+    def __init__(self, mode='report', tolerance_khz=0):
+        if mode not in DUPLICATE_MODES:
+            raise ValueError(f"Unknown duplicates mode {mode}")
+        self.merge = mode == 'merge'
+        self.index = FrequencyIndex(tolerance_khz)
+        # (earlier channel, duplicate channel, merged, miles apart or None)
+        # tuples, in the order found.
+        self.duplicates = []
+
+    def check(self, channel, can_merge=False, site=None):
+        """
+        Check a channel against the channels checked before it.  Unless it
+        is merged, it is added to the index.  Digital channels are ignored.
+        :param channel: A channel dict.
+        :param can_merge: True if the channel may be left out in favor of
+            the one it duplicates.
+        :param site: Where the channel is, as (state, lat, long), or None if
+            not known.
+        :return: The earlier channel to use in its place, if the channel is
+            a duplicate of one at the same site and is to be merged.
+            Otherwise None.
+        """
+        if channel['Channel Type'] != 'A-Analog':
+            return None
+        matches = list(self.index.matches(channel))
+        if not matches:
+            self.index.add(channel, site)
+            return None
+        # Report the one at the same site, if there is one.
+        original, original_site = next(
+            (match for match in matches if same_site(match[1], site)),
+            matches[0])
+        merged = self.merge and can_merge and same_site(original_site, site)
+        self.duplicates.append((original, channel, merged,
+                                site_distance(original_site, site)))
+        if not merged:
+            self.index.add(channel, site)
+        return original if merged else None
+
+    def check_all(self, channels):
+        """
+        Check a list of channels, e.g., those made from the YAML files.  None
+        of them are merged.
+        :param channels: A list of channel dicts.
+        :return: None
+        """
+        for channel in channels:
+            self.check(channel)
+
+    def report(self, title, file=None):
+        """
+        Print the duplicates found.
+        :param title: What was checked, e.g., the radio's name.
+        :param file: Where to print them; default stdout.
+        :return: None
+        """
+        file = file or sys.stdout
+        if not self.duplicates:
+            return
+        merged = sum(1 for _, _, was_merged, _ in self.duplicates
+                     if was_merged)
+        lines = [f"{title}: {len(self.duplicates)} duplicate channels, "
+                 f"{merged} left out"]
+        for original, duplicate, was_merged, miles in self.duplicates:
+            action = 'left out, ' if was_merged else ''
+            away = '' if miles is None else f", {miles:.0f} miles away"
+            lines.append(f"    {duplicate['Channel Name']} ({action}RX "
+                         f"{duplicate['Receive Frequency']}, TX "
+                         f"{duplicate['Transmit Frequency']}, tone "
+                         f"{duplicate['CTCSS/DCS Encode']}) duplicates "
+                         f"{original['Channel Name']}{away}")
+        # One print, so the reports for radios built in parallel don't get
+        # mixed together.
+        print('\n'.join(lines), file=file)
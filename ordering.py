@@ -0,0 +1,160 @@
+"""
+ordering.py
+The order the RepeaterBook repeaters are put in their state zones, chosen
+with builder.py --order:
+
+longitude
+    West to east; the original order.  Fine for a trip along I-70, but not
+    for one that runs north-south, like the Helena to Provo box.
+distance
+    Nearest first, from a home point (--home, by default the start of the
+    route below).
+route
+    Along a route: the repeaters are projected onto the nearest point of a
+    path, and ordered by how far along the path that is.  The path is the
+    Corridors in lat_long.yaml, joined up, with the middle of each other
+    region standing in for it; so a list of regions that follows a trip, as
+    lat_long.yaml does, gives a path that follows the trip.
+hilbert
+    Along a Hilbert curve over the repeaters' bounding box, so repeaters
+    near each other on the map are near each other in the zone.
+
+Each order turns a list of points into a list of sort keys, one per point,
+computed once; the repeaters are then sorted on those keys in one go.
+"""
+from math import cos, radians, sqrt
+
+from regions import MILES_PER_DEGREE, Corridor, hilbert_index, make_region, \
+    point_distance
+
+ORDERS = ['longitude', 'distance', 'route', 'hilbert']
+
+
+class LongitudeOrder:
+    """
+    West to east.
+    """
+    def keys(self, points):
+        """
+        :param points: A list of (lat, long).
+        :return: A list of sort keys, one per point.
+        """
+        return [long for _, long in points]
+
+
+class DistanceOrder:
+    """
+    Nearest first, from a home point.
+    """
+    def __init__(self, home):
+        self.home = home
+
+    def keys(self, points):
+        home_lat, home_long = self.home
+        return [point_distance(lat, long, home_lat, home_long)
+                for lat, long in points]
+
+
+class RouteOrder:
+    """
+    By position along a path.  Each segment is projected onto a flat plane
+    (miles east and north of its start) once, up front.
+    """
+    def __init__(self, path):
+        if not path:
+            raise ValueError("A route needs at least one point.")
+        self.start = path[0]
+        # (start lat, start long, miles per degree of longitude, the
+        # segment's east and north extent in miles, its length squared, and
+        # how far along the route it starts), for each segment.
+        self.segments = []
+        along = 0.0
+        for start, end in zip(path, path[1:]):
+            long_scale = MILES_PER_DEGREE * cos(radians((start[0] + end[0]) /
+                                                        2))
+            end_x = (end[1] - start[1]) * long_scale
+            end_y = (end[0] - start[0]) * MILES_PER_DEGREE
+            length_squared = end_x * end_x + end_y * end_y
+            self.segments.append((start[0], start[1], long_scale, end_x,
+                                  end_y, length_squared, along))
+            along += sqrt(length_squared)
+
+    def keys(self, points):
+        if not self.segments:
+            return DistanceOrder(self.start).keys(points)
+        return [self.position(lat, long) for lat, long in points]
+
+    def position(self, lat, long):
+        """
+        :return: How many miles along the route the point nearest (lat,
+            long) is.
+        """
+        best_distance = None
+        best_along = 0.0
+        for start_lat, start_long, long_scale, end_x, end_y, length_squared, \
+                along in self.segments:
+            x = (long - start_long) * long_scale
+            y = (lat - start_lat) * MILES_PER_DEGREE
+            if length_squared == 0:
+                t = 0
+            else:
+                t = max(0, min(1, (x * end_x + y * end_y) / length_squared))
+            dx = x - t * end_x
+            dy = y - t * end_y
+            distance = dx * dx + dy * dy
+            if best_distance is None or distance < best_distance:
+                best_distance = distance
+                best_along = along + t * sqrt(length_squared)
+        return best_along
+
+
+class HilbertOrder:
+    """
+    Along a Hilbert curve over the points' bounding box.
+    """
+    def keys(self, points):
+        if not points:
+            return []
+        lats = [lat for lat, _ in points]
+        longs = [long for _, long in points]
+        bounds = (min(lats), max(lats), min(longs), max(longs))
+        return [hilbert_index(lat, long, bounds) for lat, long in points]
+
+
+def route_path(lat_long):
+    """
+    :param lat_long: The lat_long.yaml regions.
+    :return: A path following them, as a list of (lat, long): each
+        Corridor's path, and the middle of each other region, in order.
+    """
+    path = []
+    for entry in lat_long:
+        region = make_region(entry)
+        if isinstance(region, Corridor):
+            path += region.path
+        else:
+            south, north, west, east = region.bounds()
+            path.append(((south + north) / 2, (west + east) / 2))
+    return path
+
+
+def make_order(name, lat_long, home=None):
+    """
+    :param name: One of ORDERS.
+    :param lat_long: The lat_long.yaml regions, for the default route and
+        home.
+    :param home: The home point for 'distance', as (lat, long).  Default:
+        the start of the route.
+    :return: An order, with a keys() method.
+    """
+    if name == 'longitude':
+        return LongitudeOrder()
+    if name == 'distance':
+        if home is None:
+            home = route_path(lat_long)[0]
+        return DistanceOrder(home)
+    if name == 'route':
+        return RouteOrder(route_path(lat_long))
+    if name == 'hilbert':
+        return HilbertOrder()
+    raise ValueError(f"Unknown order {name}")
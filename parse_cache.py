@@ -0,0 +1,153 @@
+"""
+parse_cache.py
+An on-disk cache of parsed input files, so that a build whose inputs haven't
+changed doesn't have to parse them again.
+
+Each file's entry records the file's mtime, size and content hash.  If the
+mtime and size still match, the entry is used without reading the file.  If
+they don't, the file is hashed, and the entry is still used if the contents
+are unchanged (e.g., the file was only touched).  Otherwise the file is
+parsed again and the entry replaced.
+
+The entries are also kept in memory, so a long-running build (builder.py
+--watch) doesn't read them from disk each time.  They are kept pickled, so
+that nothing the build does to the data can change the cached copy.
+"""
+import hashlib
+import os
+import pickle
+
+import yaml
+
+from build_state import file_digest
+
+CACHE_DIR = 'data_files/.cache'
+
+# The libyaml based loader is much faster than the pure Python one, but is
+# only there if PyYAML was built with libyaml.
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def parse_yaml(path):
+    """
+    Parse a YAML file, without caching.
+    :param path: The file to parse.
+    :return: The parsed data.
+    """
+    with open(path) as f:
+        return yaml.load(f, Loader=YamlLoader)
+
+
+class ParseCache:
+    """
+    The cache of parsed files.  If enabled is False, nothing is cached, and
+    every file is parsed every time.
+    """
+    def __init__(self, directory=CACHE_DIR, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        # Pickled entries, keyed by entry path.
+        self._memory = {}
+        # Entries has() has unpickled, for get() to use rather than
+        # unpickling them again.
+        self._checked = {}
+
+    def load_yaml(self, path):
+        """
+        Parse a YAML file, using the cached copy if the file hasn't changed.
+        :param path: The file to parse.
+        :return: The parsed data.
+        """
+        return self.get(path, 'yaml', lambda: parse_yaml(path))
+
+    def get(self, path, kind, parse, key=None):
+        """
+        Get the cached result of parsing a file, parsing it if need be.
+        :param path: The file.
+        :param kind: What kind of parsing is being done, e.g., 'yaml'.  Each
+            file has one entry per kind.
+        :param parse: A function of no arguments that parses the file.
+        :param key: Anything else the result depends on, e.g., the lat/long
+            regions used to filter RepeaterBook rows.  Must be picklable and
+            comparable.  If it has changed, the file is parsed again.
+        :return: The parsed data.
+        """
+        if not self.enabled:
+            return parse()
+        stat = os.stat(path)
+        entry_path = self._entry_path(path, kind)
+        entry = self._checked.pop(entry_path, None) or \
+            self._read_entry(entry_path)
+        if entry is not None and entry['key'] == key:
+            if (entry['mtime'], entry['size']) == \
+                    (stat.st_mtime_ns, stat.st_size):
+                return entry['data']
+            digest = file_digest([path])
+            if entry['digest'] == digest:
+                # The file was touched, but its contents are the same.
+                # Remember the new mtime so we don't hash it next time.
+                entry['mtime'] = stat.st_mtime_ns
+                entry['size'] = stat.st_size
+                self._write_entry(entry_path, entry)
+                return entry['data']
+        else:
+            digest = file_digest([path])
+        data = parse()
+        self._write_entry(entry_path, {'key': key,
+                                       'mtime': stat.st_mtime_ns,
+                                       'size': stat.st_size,
+                                       'digest': digest,
+                                       'data': data})
+        return data
+
+    def has(self, path, kind, key=None):
+        """
+        Whether get() would return a cached result, rather than parsing the
+        file.  Lets a caller parse the files that need it all at once, and
+        then hand each result to get().
+        :param path: The file.
+        :param kind: What kind of parsing is being done, as for get().
+        :param key: Anything else the result depends on, as for get().
+        :return: True if the file has an up to date entry.
+        """
+        if not self.enabled:
+            return False
+        entry_path = self._entry_path(path, kind)
+        entry = self._read_entry(entry_path)
+        if entry is None or entry['key'] != key:
+            return False
+        self._checked[entry_path] = entry
+        stat = os.stat(path)
+        if (entry['mtime'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+            return True
+        return entry['digest'] == file_digest([path])
+
+    def _entry_path(self, path, kind):
+        name = hashlib.sha1(repr((os.path.abspath(path), kind)).encode())
+        return os.path.join(self.directory, name.hexdigest() + '.pickle')
+
+    def _read_entry(self, entry_path):
+        try:
+            pickled = self._memory[entry_path]
+        except KeyError:
+            try:
+                with open(entry_path, 'rb') as f:
+                    pickled = f.read()
+            except OSError:
+                return None
+            self._memory[entry_path] = pickled
+        try:
+            return pickle.loads(pickled)
+        except (pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write_entry(self, entry_path, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        pickled = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory[entry_path] = pickled
+        # Write to a temporary file and rename it, so that an interrupted
+        # build can't leave a partial entry behind.
+        temp_path = entry_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(pickled)
+        os.replace(temp_path, entry_path)
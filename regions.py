@@ -0,0 +1,287 @@
+"""
+regions.py
+The areas from which RepeaterBook repeaters are taken, as listed in
+lat_long.yaml.  Each entry in lat_long.yaml is one of:
+
+A rectangle:
+    - N: <number>
+      S: <number>
+      E: <number>
+      W: <number>
+
+A polygon, as a list of [lat, long] corners:
+    - Polygon:
+        - [46.6, -112.1]
+        - [46.6, -111.9]
+        - [46.4, -112.0]
+
+A corridor, everything within some distance of a path, e.g., a highway:
+    - Corridor:
+        - [46.59, -112.04]
+        - [44.02, -112.23]
+        - [40.23, -111.66]
+      Miles: 15
+
+The regions are put in a RegionIndex, a grid of cells each listing the
+regions that overlap it, so that finding the regions a repeater might be in
+doesn't mean testing it against every region.
+
+hilbert_index() orders points along a space-filling curve, for cutting a
+set of repeaters into geographically compact groups.
+"""
+
+from math import cos, floor, radians, sqrt
+
+# Size of the RegionIndex grid cells, in degrees.
+CELL_DEGREES = 0.5
+
+# Miles per degree of latitude (and of longitude at the equator).
+MILES_PER_DEGREE = 69.09
+
+# hilbert_index() divides its box into a grid 2 ** HILBERT_ORDER cells on a
+# side.
+HILBERT_ORDER = 16
+
+
+class Rectangle:
+    """
+    A lat/long rectangle, edges included.
+    """
+    def __init__(self, north, south, west, east):
+        self.north = north
+        self.south = south
+        self.west = west
+        self.east = east
+
+    def bounds(self):
+        """
+        :return: The bounding box, as (south, north, west, east).
+        """
+        return self.south, self.north, self.west, self.east
+
+    def contains(self, lat, long):
+        return self.south <= lat <= self.north and \
+            self.west <= long <= self.east
+
+    def distance(self, lat, long):
+        """
+        :return: The distance in miles from the point to the middle of the
+            rectangle.
+        """
+        return point_distance(lat, long, (self.north + self.south) / 2,
+                              (self.west + self.east) / 2)
+
+
+class Polygon:
+    """
+    A lat/long polygon.  The edges are treated as straight lines in lat/long,
+    which is close enough at the sizes we use.
+    """
+    def __init__(self, corners):
+        self.corners = [(float(lat), float(long)) for lat, long in corners]
+        if len(self.corners) < 3:
+            raise ValueError("A Polygon needs at least three corners.")
+        lats = [lat for lat, _ in self.corners]
+        longs = [long for _, long in self.corners]
+        self.box = Rectangle(max(lats), min(lats), min(longs), max(longs))
+
+    def bounds(self):
+        return self.box.bounds()
+
+    def contains(self, lat, long):
+        if not self.box.contains(lat, long):
+            return False
+        # Even-odd rule: count the edges crossed by a line running east from
+        # the point.
+        inside = False
+        previous_lat, previous_long = self.corners[-1]
+        for corner_lat, corner_long in self.corners:
+            if (corner_lat > lat) != (previous_lat > lat):
+                crossing = corner_long + (lat - corner_lat) * \
+                    (previous_long - corner_long) / (previous_lat - corner_lat)
+                if long < crossing:
+                    inside = not inside
+            previous_lat, previous_long = corner_lat, corner_long
+        return inside
+
+    def distance(self, lat, long):
+        """
+        :return: The distance in miles from the point to the middle of the
+            polygon's bounding box.
+        """
+        return self.box.distance(lat, long)
+
+
+class Corridor:
+    """
+    Everything within a given number of miles of a path.  Distances are
+    computed on a flat projection around each path segment, which is plenty
+    accurate for corridors a few tens of miles wide.
+    """
+    def __init__(self, path, miles):
+        self.path = [(float(lat), float(long)) for lat, long in path]
+        if not self.path:
+            raise ValueError("A Corridor needs at least one point.")
+        self.miles = float(miles)
+        lats = [lat for lat, _ in self.path]
+        longs = [long for _, long in self.path]
+        # Widen the path's box by the corridor width, using the longitude
+        # scale at the latitude furthest from the equator.
+        lat_margin = self.miles / MILES_PER_DEGREE
+        long_margin = lat_margin / \
+            max(cos(radians(max(abs(lat) for lat in lats) + lat_margin)), 0.01)
+        self.box = Rectangle(max(lats) + lat_margin, min(lats) - lat_margin,
+                             min(longs) - long_margin, max(longs) + long_margin)
+
+    def bounds(self):
+        return self.box.bounds()
+
+    def contains(self, lat, long):
+        if not self.box.contains(lat, long):
+            return False
+        return self.distance(lat, long) <= self.miles
+
+    def distance(self, lat, long):
+        """
+        :return: The distance in miles from the point to the path.
+        """
+        if len(self.path) == 1:
+            return point_distance(lat, long, *self.path[0])
+        return min(segment_distance(lat, long, start, end)
+                   for start, end in zip(self.path, self.path[1:]))
+
+
+def point_distance(lat, long, other_lat, other_long):
+    """
+    :return: The approximate distance in miles between two nearby points.
+    """
+    long_scale = cos(radians((lat + other_lat) / 2))
+    dy = (lat - other_lat) * MILES_PER_DEGREE
+    dx = (long - other_long) * MILES_PER_DEGREE * long_scale
+    return sqrt(dx * dx + dy * dy)
+
+
+def segment_distance(lat, long, start, end):
+    """
+    :return: The approximate distance in miles from a point to a line segment.
+    """
+    long_scale = cos(radians(lat))
+    # Work in miles, with the start of the segment at the origin.
+    x = (long - start[1]) * MILES_PER_DEGREE * long_scale
+    y = (lat - start[0]) * MILES_PER_DEGREE
+    end_x = (end[1] - start[1]) * MILES_PER_DEGREE * long_scale
+    end_y = (end[0] - start[0]) * MILES_PER_DEGREE
+    length_squared = end_x * end_x + end_y * end_y
+    if length_squared == 0:
+        t = 0
+    else:
+        t = max(0, min(1, (x * end_x + y * end_y) / length_squared))
+    dx = x - t * end_x
+    dy = y - t * end_y
+    return sqrt(dx * dx + dy * dy)
+
+
+def make_region(entry):
+    """
+    Makes a region from an entry in lat_long.yaml.
+    :param entry: A dict, with N/S/E/W, Polygon, or Corridor and Miles keys.
+    :return: A Rectangle, Polygon or Corridor
+    """
+    if 'Polygon' in entry:
+        return Polygon(entry['Polygon'])
+    if 'Corridor' in entry:
+        try:
+            return Corridor(entry['Corridor'], entry['Miles'])
+        except KeyError:
+            raise ValueError("A Corridor needs a Miles entry.")
+    return Rectangle(entry['N'], entry['S'], entry['W'], entry['E'])
+
+
+class RegionIndex:
+    """
+    A grid over the regions in lat_long.yaml.  Each grid cell lists the
+    regions whose bounding boxes overlap it, in lat_long.yaml order, so a
+    point is only tested against the few regions near it.
+    """
+    def __init__(self, lat_long, cell_degrees=CELL_DEGREES):
+        self.regions = [make_region(entry) for entry in lat_long]
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        for region in self.regions:
+            south, north, west, east = region.bounds()
+            for row in range(self._cell(south), self._cell(north) + 1):
+                for column in range(self._cell(west), self._cell(east) + 1):
+                    self.cells.setdefault((row, column), []).append(region)
+
+    def _cell(self, degrees):
+        return floor(degrees / self.cell_degrees)
+
+    def candidates(self, lat, long):
+        """
+        :return: The regions that might contain the point.
+        """
+        return self.cells.get((self._cell(lat), self._cell(long)), [])
+
+    def find(self, lat, long):
+        """
+        :return: The first region (in lat_long.yaml order) containing the
+            point, or None.
+        """
+        for region in self.candidates(lat, long):
+            if region.contains(lat, long):
+                return region
+        return None
+
+    def contains(self, lat, long):
+        return self.find(lat, long) is not None
+
+    def distance(self, lat, long):
+        """
+        :return: The distance in miles from the point to the middle of the
+            first region containing it (the path, for a Corridor), or
+            infinity if no region contains it.
+        """
+        region = self.find(lat, long)
+        if region is None:
+            return float('inf')
+        return region.distance(lat, long)
+
+
+def hilbert_index(lat, long, bounds, order=HILBERT_ORDER):
+    """
+    The position of a point along a Hilbert curve filling a box.  Points
+    near each other on the curve are near each other on the map, so a list
+    of points sorted by their index and cut into pieces gives compact areas.
+    :param lat: The point's latitude.
+    :param long: The point's longitude.
+    :param bounds: The box, as (south, north, west, east).
+    :param order: The curve fills a grid 2 ** order cells on a side.
+    :return: The index, an int.
+    """
+    south, north, west, east = bounds
+    side = 1 << order
+    x = grid_position(long, west, east, side)
+    y = grid_position(lat, south, north, side)
+    index = 0
+    s = side >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve joins up with the next one.
+        if ry == 0:
+            if rx == 1:
+                x = side - 1 - x
+                y = side - 1 - y
+            x, y = y, x
+        s >>= 1
+    return index
+
+
+def grid_position(value, low, high, side):
+    """
+    :return: Which of side equal cells between low and high the value is in.
+    """
+    if high <= low:
+        return 0
+    return min(max(int((value - low) / (high - low) * side), 0), side - 1)
@@ -0,0 +1,350 @@
+"""
+repeater_store.py
+A typed, columnar copy of the RepeaterBook exports, so a build doesn't have
+to parse their CSV text every time.
+
+    python repeater_store.py
+
+reads the exports (as builder.py would) and writes them to
+data_files/rb_repeaters.rbc, which is then used in their place.  Run it
+again after downloading new exports; the build warns if the store is older
+than the exports it was made from.
+
+The file holds one column per RepeaterBook field the program uses, each an
+array of fixed-size numbers, one per row:
+    - Output Freq and Input Freq, as whole numbers of 10 Hz
+    - Lat and Long, as doubles
+    - State, Location, the tones, Use, Op Status and Mode, as indexes into
+      a list of the distinct values (there are only a few of each, bar
+      Location)
+The columns are memory-mapped, not read, and used through memoryviews.
+The filter on Use, Op Status and Mode is decided once per distinct value,
+and applied to a whole column at once with bytes.translate(); the masks are
+combined as integers.  Only the rows that pass are looked at one by one, to
+test their lat/long.
+
+    magic, header length (4 bytes), JSON header, padding, columns...
+
+Each column starts on an 8 byte boundary.  The numbers are in the byte
+order of the machine that wrote the file, which is recorded in the header.
+"""
+import argparse
+from array import array
+import json
+from math import isnan
+import mmap
+import os
+import re
+import struct
+import sys
+
+from timing import timed
+
+# Where the store is written, and looked for, by default.
+DEFAULT_STORE = 'data_files/rb_repeaters.rbc'
+
+# The start of every store file.
+MAGIC = b'RBSTORE1'
+
+# Bump this when the layout of the columns changes.
+STORE_FORMAT = 1
+
+HEADER_LENGTH = struct.Struct('<I')
+
+# The frequencies are stored as whole numbers of 10 Hz, i.e., the five
+# decimal places RepeaterBook gives in MHz.
+FREQUENCY_SCALE = 100000
+
+FREQUENCY_FIELDS = ['Output Freq', 'Input Freq']
+COORDINATE_FIELDS = ['Lat', 'Long']
+CATEGORY_FIELDS = ['State', 'Location', 'Uplink Tone', 'Downlink Tone', 'Use',
+                   'Op Status', 'Mode']
+
+
+def is_store(path):
+    """
+    :param path: A RepeaterBook export path.
+    :return: True if it is a store made by this module.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def frequency_units(frequency):
+    """
+    :param frequency: A frequency in MHz, as a string, e.g., '146.94000'.
+    :return: The frequency in 10 Hz units, as an int.
+    """
+    return round(float(frequency) * FREQUENCY_SCALE)
+
+
+def frequency_text(units):
+    """
+    :param units: A frequency in 10 Hz units.
+    :return: The frequency in MHz, as RepeaterBook writes it, e.g.,
+        '146.94000'.
+    """
+    return f"{units // FREQUENCY_SCALE}.{units % FREQUENCY_SCALE:05d}"
+
+
+def coordinate(text):
+    """
+    :param text: A latitude or longitude from the export.
+    :return: It as a float.  Some repeaters have none; they get NaN, which
+        is in no region.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+
+def category_typecode(count):
+    """
+    :param count: How many distinct values a category column has.
+    :return: The smallest array typecode that can index them.
+    """
+    if count <= 0x100:
+        return 'B'
+    if count <= 0x10000:
+        return 'H'
+    return 'I'
+
+
+@timed
+def write_store(rows, path, sources=()):
+    """
+    Writes RepeaterBook rows to a store file.
+    :param rows: An iterable of (state, row) pairs, as from
+        read_repeaterbook_csvs().
+    :param path: The file to write.
+    :param sources: The export files the rows came from.  Their sizes and
+        modification times are recorded, so a stale store can be noticed.
+    :return: The number of rows written.
+    """
+    numbers = {field: array('q') for field in FREQUENCY_FIELDS}
+    numbers.update({field: array('d') for field in COORDINATE_FIELDS})
+    # Each category's distinct values, in the order first seen, and the
+    # index of each value in that list.
+    values = {field: [] for field in CATEGORY_FIELDS}
+    value_index = {field: {} for field in CATEGORY_FIELDS}
+    codes = {field: [] for field in CATEGORY_FIELDS}
+    count = 0
+    for state, row in rows:
+        for field in FREQUENCY_FIELDS:
+            numbers[field].append(frequency_units(row[field]))
+        for field in COORDINATE_FIELDS:
+            numbers[field].append(coordinate(row[field]))
+        for field in CATEGORY_FIELDS:
+            value = state if field == 'State' else row[field]
+            index = value_index[field].get(value)
+            if index is None:
+                index = value_index[field][value] = len(values[field])
+                values[field].append(value)
+            codes[field].append(index)
+        count += 1
+    for field in CATEGORY_FIELDS:
+        numbers[field] = array(category_typecode(len(values[field])),
+                               codes[field])
+
+    columns = {}
+    offset = 0
+    for field, column in numbers.items():
+        columns[field] = {'type': column.typecode, 'offset': offset,
+                          'length': len(column) * column.itemsize}
+        offset += -(-columns[field]['length'] // 8) * 8
+    header = {
+        'format': STORE_FORMAT,
+        'byteorder': sys.byteorder,
+        'rows': count,
+        'columns': columns,
+        'values': values,
+        'sources': [{'path': source,
+                     'size': os.stat(source).st_size,
+                     'mtime': os.stat(source).st_mtime_ns}
+                    for source in sources],
+    }
+    header = json.dumps(header).encode()
+    start = len(MAGIC) + HEADER_LENGTH.size + len(header)
+    padding = -start % 8
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(b'\0' * padding)
+        for field, column in numbers.items():
+            data = column.tobytes()
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+    os.replace(temp_path, path)
+    return count
+
+
+class RepeaterStore:
+    """
+    A store file, memory-mapped.  Use it in a with statement, or close() it,
+    to unmap the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._map)
+        if view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a RepeaterBook store")
+        header_length, = HEADER_LENGTH.unpack_from(view, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(bytes(view[header_start:
+                                       header_start + header_length]))
+        if header['format'] != STORE_FORMAT or \
+                header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError(f"{path} was made by a different version of "
+                             f"repeater_store.py, or on a different kind of "
+                             f"machine. Run repeater_store.py again.")
+        data_start = header_start + header_length
+        data_start += -data_start % 8
+        self.rows = header['rows']
+        self.values = header['values']
+        self.sources = header['sources']
+        for field, column in header['columns'].items():
+            start = data_start + column['offset']
+            self.columns[field] = \
+                view[start:start + column['length']].cast(column['type'])
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # The memoryviews must be released before the map can be closed.
+        for column in self.columns.values():
+            column.release()
+        self.columns = {}
+        self._view.release()
+        self._map.close()
+
+    def stale_sources(self):
+        """
+        :return: The export files the store was made from that have changed
+            (or gone) since.
+        """
+        stale = []
+        for source in self.sources:
+            try:
+                stat = os.stat(source['path'])
+            except OSError:
+                stale.append(source['path'])
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != \
+                    (source['size'], source['mtime']):
+                stale.append(source['path'])
+        return stale
+
+    def mask(self, field, wanted):
+        """
+        :param field: A category field, e.g., 'Use'.
+        :param wanted: The values to keep, e.g., {'OPEN'}.
+        :return: An int with bit i set if row i's value is wanted.
+        """
+        column = self.columns[field]
+        keep = [1 if value in wanted else 0 for value in self.values[field]]
+        if column.format == 'B':
+            table = bytes(keep + [0] * (256 - len(keep)))
+            flags = column.tobytes().translate(table)
+        else:
+            flags = bytes(keep[code] for code in column)
+        return int.from_bytes(flags, 'little')
+
+    @timed
+    def matching_rows(self, criteria):
+        """
+        :param criteria: A dict of the values to keep, keyed by category
+            field, e.g., {'Use': {'OPEN'}}.  A row must match them all.
+        :return: The numbers of the rows that match, in order.
+        """
+        # Each mask has a one byte flag, 0 or 1, per row, so ANDing them
+        # together ANDs the rows' flags.
+        combined = int.from_bytes(b'\x01' * self.rows, 'little')
+        for field, wanted in criteria.items():
+            combined &= self.mask(field, wanted)
+        flags = combined.to_bytes(self.rows, 'little')
+        return [match.start() for match in re.finditer(b'\x01', flags)]
+
+    @timed
+    def rows_in_regions(self, rows, region_index):
+        """
+        :param rows: Row numbers.
+        :param region_index: A RegionIndex of the lat_long.yaml regions.
+        :return: Those of the rows whose lat/long is in one of the regions.
+        """
+        lats = self.columns['Lat']
+        longs = self.columns['Long']
+        return [i for i in rows
+                if not (isnan(lats[i]) or isnan(longs[i])) and
+                region_index.contains(lats[i], longs[i])]
+
+    def state(self, i):
+        return self.values['State'][self.columns['State'][i]]
+
+    def row(self, i):
+        """
+        :param i: A row number.
+        :return: The row, as a dict like the ones csv.DictReader() gives for
+            the export, with just the fields stored.  Lat and Long are
+            floats.
+        """
+        row = {field: frequency_text(self.columns[field][i])
+               for field in FREQUENCY_FIELDS}
+        for field in COORDINATE_FIELDS:
+            row[field] = self.columns[field][i]
+        for field in CATEGORY_FIELDS:
+            if field != 'State':
+                row[field] = self.values[field][self.columns[field][i]]
+        return row
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Convert the RepeaterBook exports to a "
+                               "columnar store, which the build then reads "
+                               "instead.")
+    parser.add_argument('--repeaterbook', action='append', metavar='PATH',
+                        help="RepeaterBook export(s) to convert, as for "
+                             "builder.py. Default: data_files/rb_repeaters "
+                             "if it exists, else data_files/rb_data.zip")
+    parser.add_argument('--output', default=DEFAULT_STORE, metavar='FILE',
+                        help=f"The store to write. Default: {DEFAULT_STORE}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, prog=None):
+    # Imported here, as repeaters_from_repeaterbook imports this module.
+    from repeaters_from_repeaterbook import CSV_SOURCES, \
+        read_repeaterbook_csvs, repeaterbook_files
+    options = parse_args(argv, prog)
+    sources = options.repeaterbook or [source for source in CSV_SOURCES
+                                       if os.path.exists(source)][:1]
+    files = repeaterbook_files(sources)
+    if any(is_store(path) for path in files):
+        sys.exit("The RepeaterBook exports to convert must be CSV, gzipped "
+                 "CSV or zip files.")
+    count = write_store(read_repeaterbook_csvs(sources), options.output,
+                        files)
+    print(f"Wrote {count} repeaters from {len(files)} export files to "
+          f"{options.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,121 +1,459 @@
 """
 repeaters_from_repeaterbook.py
 Loading analog repeater info from CSV sheets produced by RepeaterBook.
-Limits repeaters by lat/long based on user-supplied rectangles in
-lat_long.yaml
+Limits repeaters by lat/long based on user-supplied regions (rectangles,
+polygons or corridors) in lat_long.yaml
+
+The CSV sheets may be extracted into data_files/rb_repeaters, or read
+straight out of a zip archive (like data_files/rb_data.zip) or from
+gzipped CSV files.  Or they may be converted, once, into a typed columnar
+store by repeater_store.py, in which case the filtering is done on its
+columns.
+
+The repeaters are put in order within each state by one of the orders in
+ordering.py; west to east by default.
+
+The rows are streamed through the program: each row is read, filtered and
+converted before the next one is read, so only the (much smaller) converted
+repeaters that are being kept are held in memory.
+
+With jobs > 1, the CSV sheets (each file, or each member of a zip archive)
+that have to be read are read at once, each in a worker process, and their
+repeaters put back together in the order the sheets are listed; so the
+result is the same as reading them one after another.
 """
 
 from csv import DictReader
 from glob import glob
+import gzip
+import io
+from itertools import chain, repeat
 import os
-import yaml
+import zipfile
+
+from build_state import data_digest
+from ordering import LongitudeOrder
+from regions import RegionIndex
+from repeater_store import DEFAULT_STORE, RepeaterStore, is_store
+from timing import timed
+
+# Where to find the RepeaterBook exports if none are given.  The first one
+# that exists is used.
+CSV_SOURCES = ['data_files/rb_repeaters', 'data_files/rb_data.zip']
+DEFAULT_SOURCES = [DEFAULT_STORE] + CSV_SOURCES
+
+# The repeaters to use: those whose fields have one of these values.
+CRITERIA = {
+    'Use': {'OPEN'},
+    'Op Status': {'On-Air'},
+    'Mode': {'Analog', 'Analog/analog'},
+}
 
+# Bump this when the form of the repeater dicts changes, so that cached ones
+# are made again.
+REPEATER_FORMAT = 2
 
-def get_analog_repeaters_from_repeaterbook(lat_long):
+
+@timed
+def get_analog_repeaters_from_repeaterbook(lat_long, sources=None,
+                                          cache=None, order=None, jobs=1):
     """
     Entry routine for this module. All the work is in other routines, see them
     for the documentation.
-    :param lat_long: a list of lat/long rectangles. Each rectangle is a dict:
+    :param lat_long: a list of lat/long regions. See regions.py for the
+        forms they can take.  The simplest is a rectangle, a dict:
         'W': <number>
         'E': <number>
         'N': <number>
         'S': <number>
+    :param sources: A list of RepeaterBook export paths; see
+        read_repeaterbook_csvs().
+    :param cache: A ParseCache in which to keep the repeaters selected from
+        each export, or None.
+    :param order: The order to put each state's repeaters in, from
+        ordering.make_order().  Default: west to east.
+    :param jobs: How many CSV sheets to read at once, each in its own
+        process.
     :return: A list of repeater dicts in the same form that they would be from
         the YAML files.
     """
+    return list(iter_analog_repeaters_from_repeaterbook(lat_long, sources,
+                                                        cache, order, jobs))
+
+
+def iter_analog_repeaters_from_repeaterbook(lat_long, sources=None,
+                                           cache=None, order=None, jobs=1):
+    """
+    Generator version of get_analog_repeaters_from_repeaterbook().
+    :param lat_long: a list of lat/long regions, as above.
+    :param sources: A list of RepeaterBook export paths, as above.
+    :param cache: A ParseCache, or None, as above.
+    :param order: The order for each state's repeaters, as above.
+    :param jobs: How many CSV sheets to read at once, as above.
+    :return: Yields repeater dicts in the same form that they would be from
+        the YAML files.
+    """
+    region_index = RegionIndex(lat_long)
+    if cache is not None:
+        # The selected repeaters depend on the regions as well as the file.
+        regions_digest = data_digest(lat_long, REPEATER_FORMAT)
+    files = repeaterbook_files(sources)
+    # The repeaters from the CSV files that aren't cached, read all at once.
+    read_at_once = {}
+    if jobs > 1:
+        to_read = [filename for filename in files
+                   if not is_store(filename) and
+                   (cache is None or
+                    not cache.has(filename, 'repeaterbook', regions_digest))]
+        read_at_once = map_sheets(select_sheet_repeaters, to_read, jobs,
+                                  region_index)
+
+    def select(filename):
+        if filename in read_at_once:
+            return read_at_once[filename]
+        if is_store(filename):
+            return select_store_repeaters(filename, region_index)
+        return select_repeaters(filename, region_index)
+
+    selected = []
+    for filename in files:
+        if is_store(filename):
+            warn_if_stale(filename)
+        if cache is None:
+            selected.append(select(filename))
+        else:
+            selected.append(cache.get(
+                filename, 'repeaterbook',
+                lambda: list(select(filename)),
+                key=regions_digest))
+    for repeater in sort_analog_repeaters(chain.from_iterable(selected),
+                                          order):
+        yield repeater
+
+
+def select_repeaters(filename, region_index):
+    """
+    Selects the repeaters to use from one RepeaterBook export file.
+    :param filename: A CSV, gzipped CSV or zip file.
+    :param region_index: A RegionIndex of the lat/long regions.
+    :return: Yields (state, longitude, repeater) for each repeater selected.
+        The repeater is in the same form that it would be from the YAML files,
+        plus its Lat and Long.
+    """
+    return select_rows(read_repeaterbook_csvs([filename]), region_index)
+
+
+def select_sheet_repeaters(sheet, region_index):
+    """
+    Selects the repeaters to use from one CSV sheet.  Run in a worker
+    process by map_sheets().
+    :param sheet: A (filename, member) pair from repeaterbook_sheets().
+    :param region_index: A RegionIndex of the lat/long regions.
+    :return: A list of (state, longitude, repeater), as from
+        select_repeaters().
+    """
+    return list(select_rows(read_sheet(*sheet), region_index))
+
+
+def select_rows(rows, region_index):
+    """
+    Selects the repeaters to use from RepeaterBook rows.
+    :param rows: An iterable of (state, row) pairs, as from
+        read_repeaterbook_csvs().
+    :param region_index: A RegionIndex of the lat/long regions.
+    :return: Yields (state, longitude, repeater), as select_repeaters() does.
+    """
     # Get all the open analog repeaters in the desired areas from RepeaterBook
-    # CSV exports. The dicts in this list hold all the data in the CSV; they
-    # were generated by csv.DictReader().
-    analog_repeaters = read_repeaterbook_csvs(lat_long)
+    # CSV exports, as (state, row) pairs. The rows are dicts generated by
+    # csv.DictReader().
+    rows = (row for row in rows if filter_by_criteria(row[1]))
+    located_rows = filter_rows_by_lat_long(rows, region_index)
 
-    # Convert to the form the rest of the program expects.
-    converted_repeaters = convert_from_repeaterbook_to_program_form(
-        analog_repeaters)
-    return converted_repeaters
+    # Convert to the form the rest of the program expects, dropping the
+    # RepeaterBook row as we go.
+    for state, row, lat, long in located_rows:
+        repeater = convert_from_repeaterbook_to_program_form(state, row)
+        # Kept for choosing which repeaters to leave out when the radio is
+        # full; see capacity.py.
+        repeater['Lat'] = lat
+        repeater['Long'] = long
+        yield state, long, repeater
 
 
-def read_repeaterbook_csvs(lat_long):
+@timed
+def select_store_repeaters(filename, region_index):
     """
-    Loads repeaters from CSV sheets exported from RepeaterBook
-    subject to some constraints:
-    - Analog FM only. No digital modes.
-    - On-air only, no off-air or unknown
-    - Within a bounding box defined by lat_long coordinates.
-    - OPEN only, not CLOSED or PRIVATE
-    :param lat_long: a list of lat/long rectangles. Each rectangle is a dict:
-        'W': <number>
-        'E': <number>
-        'N': <number>
-        'S': <number>
-    :return: A dict of lists, keyed by state.
+    Selects the repeaters to use from a store made by repeater_store.py.
+    :param filename: The store.
+    :param region_index: A RegionIndex of the lat/long regions.
+    :return: A list of (state, longitude, repeater) for each repeater
+        selected, as from select_repeaters().
     """
-    analog_repeaters = {}
-    for filename in glob('data_files/rb_repeaters/*.csv'):
-        # We'll put these repeaters as a list of dicts, in a dict keyed
-        # by state; actually keyed by the filename minus the extension,
-        fn_key = os.path.split(os.path.splitext(filename)[0])[-1].split('_')[0]
+    with RepeaterStore(filename) as store:
+        rows = store.matching_rows(CRITERIA)
+        rows = store.rows_in_regions(rows, region_index)
+        return [store_repeater(store, i) for i in rows]
 
-        repeater_list = read_repeaterbook_csv(filename, lat_long)
-        if not repeater_list:
-            continue
-        try:
-            analog_repeaters[fn_key] += repeater_list
-        except KeyError:
-            analog_repeaters[fn_key] = []
-            analog_repeaters[fn_key] += repeater_list
-    sort_analog_repeaters(analog_repeaters)
-    return analog_repeaters
+
+def store_repeater(store, i):
+    """
+    :param store: A RepeaterStore.
+    :param i: A row number.
+    :return: (state, longitude, repeater) for the row, as from
+        select_repeaters().
+    """
+    state = store.state(i)
+    row = store.row(i)
+    repeater = convert_from_repeaterbook_to_program_form(state, row)
+    repeater['Lat'] = row['Lat']
+    repeater['Long'] = row['Long']
+    return state, row['Long'], repeater
 
 
-def read_repeaterbook_csv(filename, lat_long):
+def warn_if_stale(filename):
     """
-    Reads a single RepeaterBook CSV file, and filters the repeaters
-    for inclusion in this code plug build.
-    :param filename: The file to process
-    :param lat_long: a list of lat/long rectangles. Each rectangle is a dict:
-        'W': <number>
-        'E': <number>
-        'N': <number>
-        'S': <number>
-    :return: a list of repeaters to include.
-    """
-    repeater_list = []
-    with open(filename) as f:
-        reader = DictReader(f)
-        for row in reader:
-            if not filter_by_lat_long(row, lat_long):
-                # Skip it.
-                continue
-            if not filter_by_criteria(row):
-                continue
-            repeater_list.append(row)
-    return repeater_list
-
-
-def filter_by_lat_long(repeater, lat_long):
-    """
-    Determine whether a repeater should be included based on location.
-    :param repeater: a repeater dict, with data from the RepeaterBook CSV
-    :param lat_long: a list of lat/long rectangles. Each rectangle is a dict:
-        'W': <number>
-        'E': <number>
-        'N': <number>
-        'S': <number>
-    :return: True if the repeater should be included.
+    Prints a warning if the exports a store was made from have changed.
+    :param filename: A store made by repeater_store.py.
+    :return: None
     """
-    lat = float(repeater['Lat'])
-    long = float(repeater['Long'])
-    for box in lat_long:
-        if lat > box['N']:
-            # Doesn't fit in this box...
-            continue
-        if lat < box['S']:
-            continue
-        if long < box['W']:
-            continue
-        if long > box['E']:
+    with RepeaterStore(filename) as store:
+        stale = store.stale_sources()
+    if stale:
+        print(f"{filename} is older than {', '.join(stale)}. Run "
+              f"repeater_store.py to bring it up to date.")
+
+
+def located_repeaters(sources=None, jobs=1):
+    """
+    Reads all the repeaters that meet the criteria, wherever they are, so
+    that the repeaters for several sets of regions can be selected from one
+    read of the exports (see batch.py).
+    :param sources: A list of RepeaterBook export paths, as for
+        read_repeaterbook_csvs().
+    :param jobs: How many CSV sheets to read at once, each in its own
+        process.
+    :return: A list of (state, longitude, repeater), in the order read.  The
+        repeaters are in the same form as from select_repeaters().
+    """
+    files = repeaterbook_files(sources)
+    read = map_sheets(locate_sheet_repeaters,
+                      [filename for filename in files
+                       if not is_store(filename)], jobs)
+    located = []
+    for filename in files:
+        if is_store(filename):
+            warn_if_stale(filename)
+            with RepeaterStore(filename) as store:
+                located += [store_repeater(store, i)
+                            for i in store.matching_rows(CRITERIA)]
+        else:
+            located += read[filename]
+    return located
+
+
+def locate_sheet_repeaters(sheet):
+    """
+    Reads the repeaters that meet the criteria from one CSV sheet, for
+    located_repeaters().  Run in a worker process by map_sheets().
+    :param sheet: A (filename, member) pair from repeaterbook_sheets().
+    :return: A list of (state, longitude, repeater).
+    """
+    located = []
+    for state, row in read_sheet(*sheet):
+        if not filter_by_criteria(row):
             continue
-        return True
+        repeater = convert_from_repeaterbook_to_program_form(state, row)
+        repeater['Lat'] = float(row['Lat'])
+        repeater['Long'] = float(row['Long'])
+        located.append((state, repeater['Long'], repeater))
+    return located
+
+
+@timed
+def map_sheets(function, filenames, jobs, *arguments):
+    """
+    Runs a function over every CSV sheet in some export files, up to jobs
+    sheets at once, each in a worker process.  The sheets are independent;
+    only their results are sent back.
+    :param function: A function of a sheet (see repeaterbook_sheets()) and
+        the arguments, returning a list.
+    :param filenames: CSV, gzipped CSV and zip files.
+    :param jobs: How many processes to use.  With one, or only one sheet,
+        the function is run in this process.
+    :param arguments: Any further arguments for the function, the same for
+        every sheet.
+    :return: A dict of lists, keyed by filename.  Each file's list is its
+        sheets' lists joined in the order the sheets are listed, so it is
+        the same however the work was shared out.
+    """
+    sheets = repeaterbook_sheets(filenames)
+    sheet_arguments = [repeat(argument) for argument in arguments]
+    jobs = min(jobs, len(sheets))
+    if jobs > 1:
+        # Imported here, as it's only needed for parallel loading.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(function, sheets, *sheet_arguments))
+    else:
+        results = list(map(function, sheets, *sheet_arguments))
+    by_file = {filename: [] for filename in filenames}
+    for (filename, _), result in zip(sheets, results):
+        by_file[filename] += result
+    return by_file
+
+
+def select_located_repeaters(located, lat_long, order=None):
+    """
+    Selects the repeaters in the lat/long regions from those read by
+    located_repeaters().  The result is the same as
+    get_analog_repeaters_from_repeaterbook() gives.
+    :param located: The list from located_repeaters().
+    :param lat_long: A list of lat/long regions.
+    :param order: The order for each state's repeaters, from
+        ordering.make_order().  Default: west to east.
+    :return: A list of repeater dicts.
+    """
+    region_index = RegionIndex(lat_long)
+    return list(sort_analog_repeaters(
+        (entry for entry in located
+         if region_index.contains(entry[2]['Lat'], entry[2]['Long'])),
+        order))
+
+
+def read_repeaterbook_csvs(sources=None):
+    """
+    Reads the repeaters from CSV sheets exported from RepeaterBook, one row
+    at a time.
+    :param sources: A list of paths. Each may be a directory of CSV files,
+        a single CSV file, a gzipped CSV file, or a zip archive of CSV files.
+        If not given, the first of DEFAULT_SOURCES that exists is used.
+    :return: Yields (state, row) pairs. The state is the filename minus the
+        extension and band, e.g., Utah for Utah_2m.csv.  The row is a dict
+        from csv.DictReader().
+    """
+    for fn_key, f in open_repeaterbook_sources(sources):
+        with f:
+            for row in DictReader(f):
+                yield fn_key, row
+
+
+def open_repeaterbook_sources(sources=None):
+    """
+    Opens each RepeaterBook CSV export in turn.  Members of zip archives and
+    gzipped files are decompressed as they are read, never extracted to disk.
+    :param sources: A list of paths, as for read_repeaterbook_csvs().
+    :return: Yields (state, file) pairs, with the file open for reading text.
+    """
+    for source in repeaterbook_files(sources):
+        if zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                for member in archive.namelist():
+                    if not member.endswith('.csv'):
+                        continue
+                    f = io.TextIOWrapper(archive.open(member), newline='')
+                    yield state_key(member), f
+        else:
+            yield state_key(source), open_csv(source)
+
+
+def repeaterbook_sheets(filenames):
+    """
+    Lists the CSV sheets in some export files, each of which can be read on
+    its own by read_sheet().
+    :param filenames: CSV, gzipped CSV and zip files, as from
+        repeaterbook_files().
+    :return: A list of (filename, member) pairs, in the order
+        read_repeaterbook_csvs() would read them.  The member is the name of
+        a CSV file in a zip archive, or None.
+    """
+    sheets = []
+    for filename in filenames:
+        if zipfile.is_zipfile(filename):
+            with zipfile.ZipFile(filename) as archive:
+                sheets += [(filename, member) for member in archive.namelist()
+                           if member.endswith('.csv')]
+        else:
+            sheets.append((filename, None))
+    return sheets
+
+
+def read_sheet(filename, member=None):
+    """
+    Reads one CSV sheet.
+    :param filename: A CSV, gzipped CSV or zip file.
+    :param member: For a zip file, the CSV file in it to read.
+    :return: Yields (state, row) pairs, as read_repeaterbook_csvs() does.
+    """
+    if member is None:
+        with open_csv(filename) as f:
+            for row in DictReader(f):
+                yield state_key(filename), row
+        return
+    with zipfile.ZipFile(filename) as archive:
+        with io.TextIOWrapper(archive.open(member), newline='') as f:
+            for row in DictReader(f):
+                yield state_key(member), row
+
+
+def repeaterbook_files(sources=None):
+    """
+    Lists the files that RepeaterBook exports will be read from.
+    :param sources: A list of paths, as for read_repeaterbook_csvs().
+    :return: A list of CSV, gzipped CSV and zip files.  Directories are
+        replaced by the CSV files in them.
+    """
+    if sources is None:
+        sources = [source for source in DEFAULT_SOURCES
+                   if os.path.exists(source)][:1]
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files += sorted(glob(os.path.join(source, '*.csv')) +
+                            glob(os.path.join(source, '*.csv.gz')))
+        else:
+            files.append(source)
+    return files
+
+
+def open_csv(filename):
+    """
+    Opens a CSV file, which may be gzipped.
+    :param filename: The file to open.
+    :return: The file, open for reading text.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', newline='')
+    return open(filename, newline='')
+
+
+def state_key(filename):
+    """
+    We key the repeaters by state; actually by the filename minus the
+    extension(s) and anything after the first underscore, e.g., Utah for
+    rb_repeaters/Utah_2m.csv or Utah_2m.csv.gz.
+    :param filename: A file or archive member name.
+    :return: The state key.
+    """
+    name = os.path.basename(filename)
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    return os.path.splitext(name)[0].split('_')[0]
+
+
+def filter_rows_by_lat_long(rows, region_index):
+    """
+    Keeps the rows that are within one of the lat/long regions, as they
+    stream by.  Each row is only tested against the regions in its cell of
+    the region index.
+    :param rows: An iterable of (state, row) pairs
+    :param region_index: a RegionIndex of the lat_long.yaml regions.
+    :return: Yields (state, row, lat, long) for each row to be kept.
+    """
+    for state, row in rows:
+        lat = float(row['Lat'])
+        long = float(row['Long'])
+        if region_index.contains(lat, long):
+            yield state, row, lat, long
 
 
 def filter_by_criteria(repeater):
@@ -128,67 +466,70 @@ def filter_by_criteria(repeater):
     :param repeater: A repeater dict
     :return: True if the repeater should be included.
     """
-    if repeater['Use'] != 'OPEN':
-        return False
-    if repeater['Op Status'] != 'On-Air':
-        return False
-    if repeater['Mode'] != 'Analog' and \
-            repeater['Mode'] != 'Analog/analog':
-        return False
-    return True
+    return all(repeater[field] in values
+               for field, values in CRITERIA.items())
 
 
-def sort_analog_repeaters(analog_repeaters):
+def sort_analog_repeaters(analog_repeaters, order=None):
     """
-    Sorts the analog repeaters.  For now, the sort order is increasing
-    longitude within each state.  May want to make this more flexible in the
-    future, either including a sort command within each lat_long box, or
-    command line option, or...
-    :param analog_repeaters: A dict of lists of repeaters, keyed by state.
-    :return: A dict of lists of repeaters, now sorted.
+    Sorts the analog repeaters: the states in the order they were first seen,
+    and the repeaters within each state in the given order (see
+    ordering.py).  Repeaters that tie keep the order they were read in.
+
+    This is the one place the repeaters have to be collected, since a state's
+    repeaters may come from several files.  Each repeater's sort key is
+    worked out once, and then the whole lot is sorted in one go.
+    :param analog_repeaters: An iterable of (state, longitude, repeater)
+    :param order: An order from ordering.make_order().  Default: west to
+        east.
+    :return: Yields the repeaters, now sorted.
     """
-    for state in analog_repeaters.keys():
-        analog_repeaters[state] = sorted(analog_repeaters[state],
-                                         key=lambda d: float(d['Long']))
+    if order is None:
+        order = LongitudeOrder()
+    entries = list(analog_repeaters)
+    state_rank = {}
+    ranks = [state_rank.setdefault(state, len(state_rank))
+             for state, _, _ in entries]
+    keys = order.keys([(repeater['Lat'], repeater['Long'])
+                       for _, _, repeater in entries])
+    for i in sorted(range(len(entries)), key=lambda i: (ranks[i], keys[i])):
+        yield entries[i][2]
 
 
-def convert_from_repeaterbook_to_program_form(analog_repeaters):
+def convert_from_repeaterbook_to_program_form(state, repeater):
     """
     Distill the data from RepeaterBook removing unneeded data, and put
-    them into dicts of the same form that is created by the routines that
+    it into a dict of the same form that is created by the routines that
     read the YAML files.
-    :param analog_repeaters: A dict keyed by state of list of repeater dicts.
-    :return: a list of repeater dicts, transformed into the kind the rest of the
-        program espects.
-    """
-    new_list = []
-    for state in analog_repeaters.keys():
-        for repeater in analog_repeaters[state]:
-            # "nrd" means "New Repeater Dict"  which is too long to type over
-            # and over!
-            nrd = {}
-            # Have to figure out how to handle name better
-            nrd['Name'] = repeater['Location']
-            nrd['RX'] = repeater['Output Freq']
-            nrd['TX'] = repeater['Input Freq']
-            # Adding State, not previously used, to automatically build
-            # state zones.
-            nrd['State'] = state
-            nrd['Mode'] = 'A'
-            # Handle the CTCSS / DCS tones / codes.  If only Uplink specified,
-            # or if both are specified and the same, use "CTCSS" else use
-            # "RCTCSS" and "TCTCSS".
-            uplink = repeater['Uplink Tone']
-            downlink = repeater['Downlink Tone']
-            if uplink or downlink:
-                if not uplink:
-                    # They specified a downlink frequency but not an uplink.
-                    # Unusual, but using that for both ways isn't a problem.
-                    uplink = downlink
-                if (not downlink) or (uplink == downlink):
-                    nrd['CTCSS'] = uplink
-                else:
-                    nrd['RCTCSS'] = downlink
-                    nrd['TCTCSS'] = uplink
-            new_list.append(nrd)
-    return new_list
\ No newline at end of file
+    :param state: The state the repeater is in.
+    :param repeater: A repeater dict from the RepeaterBook CSV.
+    :return: a repeater dict, transformed into the kind the rest of the
+        program expects.
+    """
+    # "nrd" means "New Repeater Dict"  which is too long to type over
+    # and over!
+    nrd = {}
+    # Have to figure out how to handle name better
+    nrd['Name'] = repeater['Location']
+    nrd['RX'] = repeater['Output Freq']
+    nrd['TX'] = repeater['Input Freq']
+    # Adding State, not previously used, to automatically build
+    # state zones.
+    nrd['State'] = state
+    nrd['Mode'] = 'A'
+    # Handle the CTCSS / DCS tones / codes.  If only Uplink specified,
+    # or if both are specified and the same, use "CTCSS" else use
+    # "RCTCSS" and "TCTCSS".
+    uplink = repeater['Uplink Tone']
+    downlink = repeater['Downlink Tone']
+    if uplink or downlink:
+        if not uplink:
+            # They specified a downlink frequency but not an uplink.
+            # Unusual, but using that for both ways isn't a problem.
+            uplink = downlink
+        if (not downlink) or (uplink == downlink):
+            nrd['CTCSS'] = uplink
+        else:
+            nrd['RCTCSS'] = downlink
+            nrd['TCTCSS'] = uplink
+    return nrd
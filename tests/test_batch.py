@@ -0,0 +1,134 @@
+"""
+Tests for batch.py: each member's code plug is the same whichever worker
+builds it, and whatever was built before it there.
+"""
+from contextlib import redirect_stdout
+import copy
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+import batch
+import builder
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The files compared between builds; build.log holds timings and the like.
+OUTPUT_FILES = ['channels.csv', 'zones.csv', 'talkgroups.csv',
+                'radio_ids.csv', 'zone_table.txt']
+
+
+def read_outputs(output_dir, member):
+    directory = os.path.join(output_dir, member, '578')
+    outputs = {}
+    for name in OUTPUT_FILES:
+        with open(os.path.join(directory, name)) as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        # The data files are found relative to the current directory.
+        self.old_dir = os.getcwd()
+        os.chdir(REPO_DIR)
+        self.temp_dir = tempfile.mkdtemp()
+        self.members_dir = os.path.join(self.temp_dir, 'members')
+        self.make_members()
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def make_members(self):
+        """
+        Three members: "fewer" has fewer channel requests than the shared
+        data, "utah" only takes RepeaterBook repeaters from Helena to
+        Provo, and "shared" has no files of its own.
+        """
+        with open('data_files/repeaters_MT.yaml') as f:
+            repeaters = yaml.safe_load(f)
+        for path in ['data_files/repeaters_BC.yaml',
+                     'data_files/repeaters_ID.yaml']:
+            with open(path) as f:
+                repeaters.update(yaml.safe_load(f))
+        with open('data_files/channel_requests.yaml') as f:
+            requests = yaml.safe_load(f)
+        with open('data_files/special_zones.yaml') as f:
+            special_zones = yaml.safe_load(f)
+        with open('data_files/zone_order.yaml') as f:
+            zone_order = yaml.safe_load(f)
+        with open('data_files/lat_long.yaml') as f:
+            lat_long = yaml.safe_load(f)
+
+        # Leave out the analog repeaters that no other file refers to.
+        needed = {str(name) for names in special_zones.values()
+                  for name in names} | set(zone_order)
+        self.dropped = set()
+        fewer = []
+        for request in requests:
+            repeater = repeaters.get(request.get('R'))
+            if repeater is not None and repeater['Mode'] == 'A' and \
+                    repeater['Name'] not in needed:
+                self.dropped.add(repeater['Name'])
+                continue
+            fewer.append(request)
+        self.assertTrue(self.dropped)
+
+        self.write_member('fewer', 'channel_requests.yaml', fewer)
+        self.write_member('utah', 'lat_long.yaml', lat_long[:1])
+        os.makedirs(os.path.join(self.members_dir, 'shared'))
+
+    def write_member(self, member, file_name, data):
+        directory = os.path.join(self.members_dir, member)
+        os.makedirs(directory)
+        with open(os.path.join(directory, file_name), 'w') as f:
+            yaml.safe_dump(data, f)
+
+    def run_batch(self, jobs):
+        output_dir = os.path.join(self.temp_dir, f'jobs{jobs}')
+        with redirect_stdout(io.StringIO()):
+            batch.main([self.members_dir, '--AT578', '--jobs', str(jobs),
+                        '--output', output_dir])
+        return output_dir
+
+    def build_alone(self, shared_data, member):
+        """
+        Builds a member in this process, from its own copy of the shared
+        data, as if it were the only member.
+        """
+        output_dir = os.path.join(self.temp_dir, 'alone')
+        batch.init_worker(copy.deepcopy(shared_data))
+        result = batch.build_member(os.path.join(self.members_dir, member),
+                                    output_dir, ['AT578'])
+        self.assertIsNone(result['error'])
+        return read_outputs(output_dir, member)
+
+    def test_members_built_alike_by_any_worker(self):
+        members = ['fewer', 'shared', 'utah']
+        serial = self.run_batch(1)
+        parallel = self.run_batch(2)
+        shared_data = batch.load_shared_data()
+        for member in members:
+            with self.subTest(member=member):
+                alone = self.build_alone(shared_data, member)
+                self.assertEqual(read_outputs(serial, member), alone)
+                self.assertEqual(read_outputs(parallel, member), alone)
+
+        fewer = read_outputs(serial, 'fewer')['channels.csv']
+        shared = read_outputs(serial, 'shared')['channels.csv']
+        for name in self.dropped:
+            self.assertNotIn(f',"{name}",', fewer)
+            self.assertIn(f',"{name}",', shared)
+        utah = read_outputs(serial, 'utah')['zones.csv']
+        self.assertNotIn('Colorado', utah)
+        self.assertIn('Colorado',
+                      read_outputs(serial, 'shared')['zones.csv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests for capacity.py.
+"""
+import unittest
+
+from builder import Zone
+from capacity import split_state_zones
+
+
+def repeater(name, lat, long):
+    return {'Name': name, 'Lat': lat, 'Long': long,
+            'RX': '146.940', 'TX': '146.340'}
+
+
+def zone(name, repeaters):
+    new_zone = Zone(name)
+    for member in repeaters:
+        new_zone.add({'Channel Name': member['Name'],
+                      'Receive Frequency': member['RX'],
+                      'Transmit Frequency': member['TX']})
+    return new_zone
+
+
+class SplitStateZonesTest(unittest.TestCase):
+    def test_same_name_in_two_states(self):
+        # Indiana's Springville comes first, and is a long way from Utah's.
+        indiana = [repeater('Springville', 38.97, -86.63),
+                   repeater('Bedford', 38.86, -86.49)]
+        utah = [repeater('Ogden', 41.22, -111.97),
+                repeater('Layton', 41.06, -111.97),
+                repeater('Springville', 40.17, -111.61),
+                repeater('Provo', 40.23, -111.66)]
+        zones = {'Indiana': zone('Indiana', indiana),
+                 'Utah': zone('Utah', utah)}
+        state_repeaters = [('Indiana', member) for member in indiana] + \
+            [('Utah', member) for member in utah]
+
+        split = split_state_zones(zones, {'Indiana', 'Utah'},
+                                  state_repeaters, 2)
+
+        self.assertEqual(split, {'Utah': ['Utah 1', 'Utah 2']})
+        parts = [set(zones[name].members) for name in split['Utah']]
+        self.assertCountEqual(parts, [{'Springville', 'Provo'},
+                                      {'Ogden', 'Layton'}])
+        self.assertEqual(zones['Indiana'].members, ['Springville', 'Bedford'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Tests for the zone table's locations, and the order of the zones.
+"""
+import unittest
+
+from builder import Zone, zone_names_in_order
+from create_zone_table import LocationIndex
+
+
+class SplitZoneTest(unittest.TestCase):
+    def setUp(self):
+        # In the order the build put them in, e.g., along a route heading
+        # east and then back west.
+        self.repeaters = [{'Name': 'Ogden - Mt Ogden', 'Long': -111.9},
+                          {'Name': 'Vernal', 'Long': -109.5},
+                          {'Name': 'Provo - Lake Mountain', 'Long': -111.9}]
+        self.names = [repeater['Name'] for repeater in self.repeaters]
+
+    def test_location_from_first_and_last(self):
+        index = LocationIndex({}, [('Utah', repeater)
+                                   for repeater in self.repeaters],
+                              {'Utah': ['Utah 1', 'Utah 2']})
+        self.assertEqual(index.zone_location('Utah 1', self.names),
+                         "Utah: Ogden to Provo")
+
+    def test_numbered_zone_that_isnt_a_part(self):
+        index = LocationIndex({}, [('Net', repeater)
+                                   for repeater in self.repeaters])
+        self.assertEqual(index.zone_location('Net 2', self.names), "")
+
+    def test_zone_order(self):
+        zones = {name: Zone(name) for name in ['Utah 10', 'Utah 2', 'Net 2',
+                                               'Net 10', 'Montana']}
+        split_zones = {'Utah': [f'Utah {number}'
+                                for number in range(1, 11)]}
+        self.assertEqual(zone_names_in_order(zones, ['Montana'], split_zones),
+                         ['Montana', 'Net 10', 'Net 2', 'Utah 2', 'Utah 10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
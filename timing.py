@@ -0,0 +1,172 @@
+"""
+timing.py
+Timing and profiling for the stages of the build.
+
+The functions that make up the stages are decorated with @timed.  When the
+timer is started (e.g., by --timings), each call is timed and, optionally,
+the memory it allocates is measured with tracemalloc.  Otherwise the
+decorator just calls the function.  Stages may be nested; a stage's figures
+include those of the stages within it.
+"""
+from contextlib import contextmanager
+import functools
+import sys
+import time
+import tracemalloc
+
+
+class StageTimer:
+    """
+    Collects the wall time, call count and memory figures for each stage.
+    The results are a dict keyed by stage name, each a dict of:
+        calls: The number of times the stage ran
+        seconds: The total wall time
+        peak_bytes: The most memory in use at any point in the stage, above
+            what was in use when it started (only if measuring memory)
+        allocated_bytes: The memory the stage left allocated when it
+            finished, summed over its calls (only if measuring memory)
+    """
+    def __init__(self):
+        self.enabled = False
+        self.measure_memory = False
+        self.results = {}
+        self._stack = []
+        self._started_tracemalloc = False
+
+    def start(self, measure_memory=True):
+        self.enabled = True
+        self.measure_memory = measure_memory
+        self.results = {}
+        if measure_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        self.enabled = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code in the with block as the named stage.
+        :param name: The stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+        frame = {'peak': 0}
+        if self.measure_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # Resetting the peak for this stage would lose the enclosing
+                # stage's peak so far, so save it.
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak - parent['start'])
+            frame['start'] = current
+            reset_peak()
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            result = self.results.setdefault(name, {'calls': 0, 'seconds': 0})
+            result['calls'] += 1
+            result['seconds'] += elapsed
+            if self.measure_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                frame['peak'] = max(frame['peak'], peak - frame['start'])
+                result['peak_bytes'] = max(result.get('peak_bytes', 0),
+                                           frame['peak'])
+                result['allocated_bytes'] = \
+                    result.get('allocated_bytes', 0) + current - frame['start']
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['peak'] = max(parent['peak'],
+                                         frame['peak'] + frame['start'] -
+                                         parent['start'])
+
+    def run(self, name, function, *args):
+        """
+        Runs a function as the named stage.
+        :return: Whatever the function returns.
+        """
+        with self.stage(name):
+            return function(*args)
+
+    def report(self, file=None):
+        """
+        Prints a table of the results.
+        :param file: Where to print it; default stdout.
+        """
+        file = file or sys.stdout
+        print(f"{'Stage':50} {'Calls':>6} {'Seconds':>9} {'Peak MB':>9} "
+              f"{'Alloc MB':>9}", file=file)
+        for name, result in self.results.items():
+            peak = result.get('peak_bytes')
+            allocated = result.get('allocated_bytes')
+            peak = f"{peak / 1e6:9.2f}" if peak is not None else f"{'-':>9}"
+            allocated = f"{allocated / 1e6:9.2f}" \
+                if allocated is not None else f"{'-':>9}"
+            print(f"{name:50} {result['calls']:6} {result['seconds']:9.4f} "
+                  f"{peak} {allocated}", file=file)
+
+
+def reset_peak():
+    # tracemalloc.reset_peak() is new in Python 3.9.  Without it, the peaks
+    # reported are the peaks since the program started.
+    try:
+        tracemalloc.reset_peak()
+    except AttributeError:
+        pass
+
+
+# The timer used by @timed.
+timer = StageTimer()
+
+
+def timed(function):
+    """
+    Decorator making a function a stage timed by the timer, under its own
+    name.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not timer.enabled:
+            return function(*args, **kwargs)
+        with timer.stage(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def instrument(timings=False, profile=None):
+    """
+    Times and/or profiles the code in the with block, for --timings and
+    --profile.
+    :param timings: If True, report the time, call count and memory for
+        each stage at the end.
+    :param profile: If given, a file to write cProfile stats to.  These can
+        be read with pstats, or turned into a flame graph with tools such as
+        flameprof or snakeviz.
+    """
+    if timings:
+        timer.start()
+    profiler = None
+    if profile:
+        # Imported here, as it's only needed for --profile.
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if timings:
+            timer.stop()
+            timer.report()
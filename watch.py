@@ -0,0 +1,179 @@
+"""
+watch.py
+Watching the input files for changes, for builder.py --watch.
+
+On Linux the directories are watched with inotify, through ctypes, so a
+save is noticed as soon as it happens.  Elsewhere, or if inotify can't be
+used, the directories are polled for changed modification times and sizes.
+
+Editors often save a file in several steps (write a temporary file, rename
+it, touch a backup), so changes are collected until the files have been
+quiet for a moment, and then reported together.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# How long the files must be quiet before the changes are reported.
+DEBOUNCE_SECONDS = 0.1
+
+# How often the PollingWatcher looks at the files.
+POLL_SECONDS = 0.25
+
+# inotify events: a file written and closed, created, deleted or renamed.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE
+
+# The fixed part of a struct inotify_event: wd, mask, cookie, len.
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_input_name(name):
+    """
+    :param name: A file name.
+    :return: False for the editor temporary and backup files, and hidden
+        files (such as the parse cache), that shouldn't start a build.
+    """
+    return not (name.startswith('.') or name.endswith('~') or
+                name.endswith('.swp') or name.endswith('.tmp'))
+
+
+class InotifyWatcher:
+    """
+    Watches directories with Linux inotify.
+    """
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        try:
+            self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        except AttributeError:
+            raise OSError("inotify is not available")
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self._fd,
+                                        os.fsencode(directory),
+                                        WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self._fd)
+                raise OSError(error, f"Can't watch {directory}")
+            self._directories[wd] = directory
+
+    def wait(self, timeout=None):
+        """
+        Wait for files to change.
+        :param timeout: The most seconds to wait, or None to wait forever.
+        :return: A set of the paths that changed; empty if none did before
+            the timeout.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        buffer = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            name = os.fsdecode(name)
+            if name and is_input_name(name) and wd in self._directories:
+                changed.add(os.path.join(self._directories[wd], name))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Watches directories by looking at their files' modification times and
+    sizes every POLL_SECONDS.
+    """
+    def __init__(self, directories, interval=POLL_SECONDS):
+        self._directories = list(directories)
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for directory in self._directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or not is_input_name(entry.name):
+                    continue
+                stat = entry.stat()
+                snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """
+        Wait for files to change.
+        :param timeout: The most seconds to wait, or None to wait forever.
+        :return: A set of the paths that changed; empty if none did before
+            the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return set()
+                time.sleep(min(self._interval, remaining))
+            else:
+                time.sleep(self._interval)
+
+    def close(self):
+        pass
+
+
+def make_watcher(directories):
+    """
+    :param directories: The directories to watch.
+    :return: An InotifyWatcher if inotify works here, otherwise a
+        PollingWatcher.
+    """
+    try:
+        return InotifyWatcher(directories)
+    except OSError:
+        return PollingWatcher(directories)
+
+
+def changes(watcher, debounce=DEBOUNCE_SECONDS):
+    """
+    Waits for changes, forever.
+    :param watcher: An InotifyWatcher or PollingWatcher.
+    :param debounce: How many seconds the files must be quiet before the
+        changes are reported.
+    :return: Yields a set of the paths changed, each time some change and
+        then stay quiet for the debounce time.
+    """
+    while True:
+        changed = watcher.wait()
+        while True:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed |= more
+        yield changed